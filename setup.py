@@ -51,12 +51,14 @@ setup(
         # eg: 'aspectlib==1.1.1', 'six>=1.7',
         'shapely>=1.6',
         'geopandas>=0.4.0',
+        'pygeos>=0.10',
         'rtree>=0.8'
     ],
     extras_require={
         # eg:
         #   'rst': ['docutils>=0.11'],
         #   ':python_version=="2.6"': ['argparse'],
+        'numba': ['numba>=0.50'],
     },
     entry_points={
         'console_scripts': [
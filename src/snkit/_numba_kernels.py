@@ -0,0 +1,131 @@
+"""Compiled loops over network topology arrays
+
+Kernels take and return plain numpy arrays only, so they compile with numba
+when it is available and run as (slow) python otherwise.
+"""
+import numpy as np
+
+# optional compilation
+try:
+    from numba import njit
+except ImportError:
+    from snkit.utils import njit_standin as njit
+
+
+@njit(cache=True)
+def _walk_chain(indptr, neighbours, edge_of_neigh, deg, visited, node, edge,
+                chain_edges, n_edges, chain_nodes, n_nodes):
+    """Follow edges from node while nodes are degree 2 and not yet visited
+
+    Returns the node the walk stopped at and the updated edge and node counts.
+    """
+    while deg[node] == 2 and indptr[node + 1] - indptr[node] == 2 and not visited[node]:
+        visited[node] = True
+        chain_nodes[n_nodes] = node
+        n_nodes += 1
+        i = indptr[node]
+        if edge_of_neigh[i] == edge:
+            i += 1
+        edge = edge_of_neigh[i]
+        node = neighbours[i]
+        chain_edges[n_edges] = edge
+        n_edges += 1
+    return node, n_edges, n_nodes
+
+
+@njit(cache=True)
+def walk_deg2_chains(indptr, neighbours, edge_of_neigh, deg):
+    """Find chains of edges joined by degree 2 nodes
+
+    Args:
+        indptr (numpy.array): CSR offsets into neighbours for each node
+        neighbours (numpy.array): node at the other end of each node-edge incidence
+        edge_of_neigh (numpy.array): edge of each node-edge incidence
+        deg (numpy.array): degree of each node
+
+    Returns:
+        chain_edges, edge_ptr (numpy.array): edges of each chain, flat with offsets
+        chain_nodes, node_ptr (numpy.array): degree 2 nodes inside each chain, flat with offsets
+        chain_ends (numpy.array): the two end nodes of each chain
+    """
+    n = len(indptr) - 1
+    visited = np.zeros(n, dtype=np.bool_)
+    chain_edges = np.empty(len(edge_of_neigh), dtype=np.int64)
+    chain_nodes = np.empty(n, dtype=np.int64)
+    edge_ptr = np.zeros(n + 1, dtype=np.int64)
+    node_ptr = np.zeros(n + 1, dtype=np.int64)
+    chain_ends = np.empty((n, 2), dtype=np.int64)
+    n_chains = 0
+    n_edges = 0
+    n_nodes = 0
+    for node in range(n):
+        if deg[node] != 2 or indptr[node + 1] - indptr[node] != 2 or visited[node]:
+            continue
+        i = indptr[node]
+        edge1 = edge_of_neigh[i]
+        edge2 = edge_of_neigh[i + 1]
+        # self loop, or both edges lead to the same node: nothing to merge
+        if edge1 == edge2 or neighbours[i] == neighbours[i + 1]:
+            continue
+        visited[node] = True
+        chain_edges[n_edges] = edge1
+        n_edges += 1
+        end1, n_edges, n_nodes = _walk_chain(
+            indptr, neighbours, edge_of_neigh, deg, visited, neighbours[i], edge1,
+            chain_edges, n_edges, chain_nodes, n_nodes)
+        if end1 == node:
+            # walked all the way round a ring of degree 2 nodes, edge2 is already in
+            # and the start node is kept as both ends of the ring
+            end2 = node
+        else:
+            chain_nodes[n_nodes] = node
+            n_nodes += 1
+            chain_edges[n_edges] = edge2
+            n_edges += 1
+            end2, n_edges, n_nodes = _walk_chain(
+                indptr, neighbours, edge_of_neigh, deg, visited, neighbours[i + 1], edge2,
+                chain_edges, n_edges, chain_nodes, n_nodes)
+        chain_ends[n_chains, 0] = end1
+        chain_ends[n_chains, 1] = end2
+        n_chains += 1
+        edge_ptr[n_chains] = n_edges
+        node_ptr[n_chains] = n_nodes
+    return (chain_edges[:n_edges], edge_ptr[:n_chains + 1],
+            chain_nodes[:n_nodes], node_ptr[:n_chains + 1], chain_ends[:n_chains])
+
+
+@njit(cache=True)
+def hanging_cascade(deg, from_ids, to_ids, lengths, tol):
+    """Find edges to drop at degree 1 nodes and update node degrees
+
+    Edges at a degree 1 node are dropped if shorter than tol. Afterwards, edges
+    with both ends at degree 1 are disconnected and dropped as well. Such an edge
+    is the only one at either of its nodes, so these drops do not affect each other.
+
+    Args:
+        deg (numpy.array): degree of each node
+        from_ids, to_ids (numpy.array): end nodes of each edge
+        lengths (numpy.array): length of each edge
+        tol (float): edges at degree 1 nodes shorter than this are dropped
+
+    Returns:
+        drop (numpy.array): boolean mask of edges to drop
+        deg (numpy.array): updated copy of the node degrees
+    """
+    deg = deg.copy()
+    n = len(from_ids)
+    hanging = np.zeros(n, dtype=np.bool_)
+    drop = np.zeros(n, dtype=np.bool_)
+    for e in range(n):
+        hanging[e] = deg[from_ids[e]] == 1 or deg[to_ids[e]] == 1
+    for e in range(n):
+        if hanging[e] and lengths[e] < tol:
+            drop[e] = True
+            deg[from_ids[e]] -= 1
+            deg[to_ids[e]] -= 1
+    for e in range(n):
+        if hanging[e] and not drop[e] and deg[from_ids[e]] == 1 and deg[to_ids[e]] == 1:
+            drop[e] = True
+            deg[from_ids[e]] -= 1
+            deg[to_ids[e]] -= 1
+    return drop, deg
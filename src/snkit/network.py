@@ -16,6 +16,8 @@ import pygeos as pyg
 from pgpkg import Geopackage
 from numpy.ma import masked
 
+from snkit.utils import remap_ids
+
 
 def metrics(graph):
     """This method prints some basic network metrics of an iGraph
@@ -209,14 +211,13 @@ def nearest(geom, gdf,sindex, tolerance):
         buf = pyg.buffer(geom, tolerance)
         matches_idx = sindex.query(buf,'contains').tolist()
     try:
-        nearest_geom = min(
-            [gdf.iloc[match_idx] for match_idx in matches_idx],
-            key=lambda match: pyg.measurement.distance(match.geometry,geom)
-        )
+        matches_idx = np.asarray(matches_idx, dtype=np.intp)
+        dists = pyg.measurement.distance(gdf['geometry'].to_numpy()[matches_idx], geom)
+        nearest_idx = matches_idx[dists.argmin()]
     except: 
         print("Couldn't find node")
         return -1
-    return nearest_geom.id
+    return gdf['id'].iat[nearest_idx]
 
 
 def percolation_Final(edges, del_frac=0.01, OD_list=[], pop_list=[], GDP_per_capita=50000):
@@ -413,15 +414,10 @@ def reset_ids(edges, nodes):
     to_ids =  edges['to_id'].to_numpy()
     from_ids = edges['from_id'].to_numpy()
     new_node_ids = range(len(nodes))
-    #creates a dictionary of the node ids and the actual indices
-    id_dict = dict(zip(nodes.id,new_node_ids))
-    nt = np.copy(to_ids)
-    nf = np.copy(from_ids) 
-    #updates all from and to ids, because many nodes are effected, this
-    #is quite optimal approach for large dataframes
-    for k,v in id_dict.items():
-        nt[to_ids==k] = v
-        nf[from_ids==k] = v
+    #updates all from and to ids to the position of their node, with one sorted
+    #lookup instead of a pass over the edges per node
+    nt = remap_ids(to_ids, nodes['id'].to_numpy())
+    nf = remap_ids(from_ids, nodes['id'].to_numpy())
     edges.drop(labels=['to_id','from_id'],axis=1,inplace=True)
     edges['from_id'] = nf
     edges['to_id'] = nt
@@ -3,6 +3,9 @@
 Ben Dickens, Elco Koks & Tom Russell
 """
 import os
+import re
+
+from functools import lru_cache
 
 import numpy as np
 import pandas as pd
@@ -17,11 +20,21 @@ from timeit import default_timer as timer
 import igraph as ig
 
 from pandas import DataFrame
-from shapely.geometry import Point, MultiPoint, LineString, GeometryCollection, shape, mapping
-from shapely.ops import split, linemerge
+from shapely.geometry import Point, MultiPoint, LineString, GeometryCollection
+from shapely.ops import linemerge
 from tqdm import tqdm
 #from pgpkg import Geopackage
 
+from snkit._numba_kernels import hanging_cascade, walk_deg2_chains
+from snkit.utils import remap_ids
+
+# STRtree queries take the dwithin predicate from pygeos 0.12 built with GEOS 3.10,
+# before that buffer and intersect
+HAS_DWITHIN = (
+    tuple(map(int, re.match(r'(\d+)\.(\d+)', pygeos.__version__).groups())) >= (0, 12)
+    and pygeos.geos_version >= (3, 10, 0)
+)
+
 # optional progress bars
 '''
 if 'SNKIT_PROGRESS' in os.environ and os.environ['SNKIT_PROGRESS'] in ('1', 'TRUE'):
@@ -45,8 +58,14 @@ class Network():
     ----------
     nodes : pandas.DataFrame
     edges : pandas.DataFrame
+    node_sindex : pygeos.STRtree
+    edge_sindex : pygeos.STRtree
+    sindex_leafsize : int
+        Maximum number of geometries in a leaf of the spatial indexes, set on
+        the class to change it for all networks. Defaults to 10.
 
     """
+    sindex_leafsize = 10
 
     def __init__(self, nodes=None, edges=None):
         """
@@ -59,6 +78,20 @@ class Network():
             edges = pd.DataFrame()
         self.edges = edges
 
+    @property
+    def node_sindex(self):
+        """Spatial index of node geometries, built from the current geometries on
+        each access, so keep a reference to query it more than once
+        """
+        return _build_sindex(self.nodes, self.sindex_leafsize)
+
+    @property
+    def edge_sindex(self):
+        """Spatial index of edge geometries, built from the current geometries on
+        each access, so keep a reference to query it more than once
+        """
+        return _build_sindex(self.edges, self.sindex_leafsize)
+
 
     def set_crs(self, crs=None, epsg=None):
         """Set network (node and edge) crs
@@ -101,6 +134,18 @@ class Network():
         self.nodes.to_crs(crs, inplace=True)
 
 
+def _build_sindex(df, leafsize=10):
+    """Build a spatial index of the geometry column of df
+
+    Args:
+        df (pandas.DataFrame): nodes or edges
+        leafsize (int, optional): maximum number of geometries in a tree leaf. Defaults to 10.
+
+    Returns:
+        sindex (pygeos.STRtree)
+    """
+    return pygeos.STRtree(df[geometry_column_name(df)].to_numpy(), leafsize=leafsize)
+
 def add_ids(network, id_col='id', edge_prefix='', node_prefix=''):
     """Add or replace an id column with ascending ids
 
@@ -131,45 +176,56 @@ def add_ids(network, id_col='id', edge_prefix='', node_prefix=''):
         edges=edges
     )
 
-def add_topology(network, id_col='id'):
+def add_topology(network, id_col='id', tolerance=1e-9):
     """Add or replace from_id, to_id to edges
 
+    All edge endpoints are matched to nodes with a single nearest query on the
+    node spatial index. Edges with an endpoint further than tolerance from any
+    node are not connected to the network and are dropped.
+
     Args:
         network (class): A network composed of nodes (points in space) and edges (lines)
         id_col (str, optional): [description]. Defaults to 'id'.
+        tolerance (float, optional): Maximum distance from an edge endpoint to its node. Defaults to 1e-9.
 
     Returns:
         network (class): A network composed of nodes (points in space) and edges (lines)
-    """    
-
-    from_ids = []
-    to_ids = []
-    node_ends = []
-    bugs = []
-    
-    sindex = pygeos.STRtree(network.nodes.geometry)
-    for edge in tqdm(network.edges.itertuples(), desc="topology", total=len(network.edges)):
-        start, end = line_endpoints(edge.geometry)
-
-        try: 
-            start_node = nearest_node(start, network.nodes,sindex)
-            from_ids.append(start_node[id_col])
-        except:
-            bugs.append(edge.id)
-            from_ids.append(-1)
-        try:
-            end_node = nearest_node(end, network.nodes,sindex)
-            to_ids.append(end_node[id_col])
-        except:
-            bugs.append(edge.id)
-            to_ids.append(-1)
-
-    print(len(bugs)," Edges not connected to nodes")
-    edges = network.edges.copy()
-    nodes = network.nodes.copy()
-    edges['from_id'] = from_ids
-    edges['to_id'] = to_ids
-    edges = edges.loc[~(edges.id.isin(list(bugs)))].reset_index(drop=True)
+    """
+    edge_geoms = network.edges.geometry.values
+    node_geoms = network.nodes.geometry.values
+    node_ids = network.nodes[id_col].to_numpy()
+
+    #first and last coordinate of every edge, taken from one flat coordinate array
+    coords = pygeos.get_coordinates(edge_geoms)
+    num_coords = pygeos.get_num_coordinates(edge_geoms)
+    last_idx = np.cumsum(num_coords)
+    first_idx = last_idx - num_coords
+    has_coords = num_coords > 0
+    starts = np.full(len(edge_geoms), None, dtype=object)
+    ends = np.full(len(edge_geoms), None, dtype=object)
+    starts[has_coords] = pygeos.points(coords[first_idx[has_coords]])
+    ends[has_coords] = pygeos.points(coords[last_idx[has_coords] - 1])
+
+    sindex = network.node_sindex
+
+    def _nearest_node_idx(points):
+        #missing geometries are left out of the query result, so scatter back by input index
+        point_idx, node_idx = sindex.nearest(points)
+        nearest_idx = np.full(len(points), -1)
+        nearest_idx[point_idx] = node_idx
+        found = nearest_idx > -1
+        found[found] = pygeos.distance(points[found], node_geoms[nearest_idx[found]]) <= tolerance
+        nearest_idx[~found] = -1
+        return nearest_idx
+
+    from_idx = _nearest_node_idx(starts)
+    to_idx = _nearest_node_idx(ends)
+    connected = (from_idx > -1) & (to_idx > -1)
+
+    print((~connected).sum()," Edges not connected to nodes")
+    edges = network.edges.loc[connected].reset_index(drop=True)
+    edges['from_id'] = node_ids[from_idx[connected]]
+    edges['to_id'] = node_ids[to_idx[connected]]
 
     return Network(
         nodes=network.nodes,
@@ -185,20 +241,16 @@ def get_endpoints(network):
     Returns:
         [type]: [description]
     """    
-    endpoints = []
-    for edge in tqdm(network.edges.itertuples(), desc="endpoints", total=len(network.edges)):
-        if edge.geometry is None:
-            continue
-        # 5 is MULTILINESTRING
-        if pygeom.get_type_id(edge.geometry) == '5':
-            for line in edge.geometry.geoms:
-                start, end = line_endpoints(line)
-                endpoints.append(start)
-                endpoints.append(end)
-        else:
-            start, end = line_endpoints(edge.geometry)
-            endpoints.append(start)
-            endpoints.append(end)
+    # MULTILINESTRING parts each get their own endpoints, missing geometries are skipped
+    lines = pygeos.get_parts(network.edges.geometry.values)
+    coords, index = pygeos.get_coordinates(lines, return_index=True)
+    # a line starts where its index differs from the previous one and ends where
+    # it differs from the next one, padding with -1 marks both ends of the array
+    change = np.diff(index, prepend=-1, append=-1) != 0
+    starts = coords[np.flatnonzero(change[:-1])]
+    ends = coords[np.flatnonzero(change[1:])]
+    # interleave start, end for each line
+    endpoints = pygeos.points(np.stack([starts, ends], axis=1).reshape(-1, 2))
 
     # create dataframe to match the nodes geometry column name
     return matching_df_from_geoms(network.nodes, endpoints)
@@ -231,12 +283,8 @@ def round_geometries(network, precision=3):
     Returns:
         network (class): A network composed of nodes (points in space) and edges (lines)
     """    
-
-    def _set_precision(geom):
-        return set_precision(geom, precision)
-
-    network.nodes.geometry = network.nodes.geometry.apply(_set_precision)
-    network.edges.geometry = network.edges.geometry.apply(_set_precision)
+    network.nodes.geometry = set_precision(network.nodes.geometry.to_numpy(), precision)
+    network.edges.geometry = set_precision(network.edges.geometry.to_numpy(), precision)
     return network
 
 
@@ -253,24 +301,15 @@ def split_multilinestrings(network):
         network (class): A network composed of nodes (points in space) and edges (lines)
     """
 
-    simple_edge_attrs = []
-    simple_edge_geoms = []
-    edges = network.edges
-    for edge in tqdm(edges.itertuples(index=False), desc="split_multi", total=len(edges)):
-        if pygeom.get_type_id(edge.geometry) == 5:
-            edge_parts = [x for x in pygeos.geometry.get_geometry(edge, pygeos.geometry.get_num_geometries(edge))]
-        else:
-            edge_parts = [edge.geometry]
-
-        for part in edge_parts:
-            simple_edge_geoms.append(part)
-
-        attrs = DataFrame([edge] * len(edge_parts))
-        simple_edge_attrs.append(attrs)
-
-    simple_edge_geoms = DataFrame(simple_edge_geoms, columns=['geometry'])
-    edges = pd.concat(simple_edge_attrs, axis=0).reset_index(drop=True).drop('geometry', axis=1)
-    edges = pd.concat([edges, simple_edge_geoms], axis=1)
+    #get_parts passes single part geometries through, index maps each part to its edge
+    geoms = network.edges.geometry.values
+    parts, index = pygeos.get_parts(geoms, return_index=True)
+    #missing or empty geometries have no parts, scatter them back in as they are
+    no_parts = np.setdiff1d(np.arange(len(geoms)), index)
+    order = np.argsort(np.concatenate([index, no_parts]), kind='stable')
+    index = np.concatenate([index, no_parts])[order]
+    parts = np.concatenate([parts, geoms[no_parts]])[order]
+    edges = network.edges.iloc[index].reset_index(drop=True).assign(geometry=parts)
 
     return Network(
         nodes=network.nodes,
@@ -319,19 +358,21 @@ def snap_nodes(network, threshold=None):
     Returns:
         [type]: [description]
     """    
-    def snap_node(node):
-        snap = nearest_point_on_edges(node.geometry, network.edges)
-        distance = snap.distance(node.geometry)
-        if threshold is not None and distance > threshold:
-            snap = node.geometry
-        return snap
-
-    snapped_geoms = network.nodes.apply(snap_node, axis=1)
     geom_col = geometry_column_name(network.nodes)
-    nodes = pd.concat([
-        network.nodes.drop(geom_col, axis=1),
-        DataFrame(snapped_geoms, columns=[geom_col])
-    ], axis=1)
+    node_geoms = network.nodes[geom_col].to_numpy()
+    edge_geoms = network.edges[geometry_column_name(network.edges)].to_numpy()
+
+    #nearest edge for all nodes at once, the snap is the end of the shortest line on the edge
+    edge_sindex = network.edge_sindex
+    node_idx, edge_idx = edge_sindex.nearest(node_geoms)
+    snap = pygeos.get_point(pygeos.shortest_line(node_geoms[node_idx], edge_geoms[edge_idx]), 1)
+    if threshold is not None:
+        snap = np.where(pygeos.distance(snap, node_geoms[node_idx]) > threshold, node_geoms[node_idx], snap)
+
+    snapped_geoms = node_geoms.copy()
+    snapped_geoms[node_idx] = snap
+    nodes = network.nodes.copy()
+    nodes[geom_col] = snapped_geoms
 
     return Network(
         nodes=nodes,
@@ -350,21 +391,29 @@ def link_nodes_to_edges_within(network, distance, condition=None, tolerance=1e-9
     Returns:
         [type]: [description]
     """       
-    new_node_geoms = []
-    new_edge_geoms = []
-    for node in tqdm(network.nodes.itertuples(index=False), desc="link", total=len(network.nodes)):
-        # for each node, find edges within
-        edges = edges_within(node.geometry, network.edges, distance)
-        for edge in edges.itertuples():
-            if condition is not None and not condition(node, edge):
-                continue
-            # add nodes at points-nearest
-            point = nearest_point_on_line(node.geometry, edge.geometry)
-            if point != node.geometry:
-                new_node_geoms.append(point)
-                # add edges linking
-                line = LineString([node.geometry, point])
-                new_edge_geoms.append(line)
+    node_geoms = network.nodes[geometry_column_name(network.nodes)].to_numpy()
+    edge_geoms = network.edges[geometry_column_name(network.edges)].to_numpy()
+    # for all nodes at once, find (node, edge) pairs within distance
+    if HAS_DWITHIN:
+        node_idx, edge_idx = network.edge_sindex.query_bulk(node_geoms, predicate='dwithin', distance=distance)
+    else:
+        node_idx, edge_idx = network.edge_sindex.query_bulk(pygeos.buffer(node_geoms, distance), predicate='intersects')
+    if condition is not None:
+        nodes = network.nodes.iloc[node_idx].itertuples(index=False)
+        edges = network.edges.iloc[edge_idx].itertuples()
+        keep = np.fromiter((condition(node, edge) for node, edge in zip(nodes, edges)), dtype=bool, count=len(node_idx))
+        node_idx, edge_idx = node_idx[keep], edge_idx[keep]
+
+    # add nodes at points-nearest
+    from_points = node_geoms[node_idx]
+    points = pygeos.get_point(pygeos.shortest_line(from_points, edge_geoms[edge_idx]), 1)
+    moved = ~pygeos.equals_exact(points, from_points)
+    new_node_geoms = points[moved]
+    # add edges linking
+    new_edge_geoms = pygeos.linestrings(np.stack([
+        pygeos.get_coordinates(from_points[moved]),
+        pygeos.get_coordinates(new_node_geoms)
+    ], axis=1))
 
     new_nodes = matching_df_from_geoms(network.nodes, new_node_geoms)
     all_nodes = concat_dedup([network.nodes, new_nodes])
@@ -393,9 +442,10 @@ def link_nodes_to_nearest_edge(network, condition=None):
 
     new_node_geoms = []
     new_edge_geoms = []
+    edge_sindex = network.edge_sindex
     for node in tqdm(network.nodes.itertuples(index=False), desc="link", total=len(network.nodes)):
         # for each node, find edges within
-        edge = nearest_edge(node.geometry, network.edges)
+        edge = nearest_edge(node.geometry, network.edges, edge_sindex)
         if condition is not None and not condition(node, edge):
             continue
         # add nodes at points-nearest
@@ -426,12 +476,9 @@ def find_roundabouts(network):
         network (class): A network composed of nodes (points in space) and edges (lines)
 
     Returns:
-        roundabouts (list): Returns the edges that can be identified as roundabouts
+        roundabouts (pandas.DataFrame): Returns the edges that can be identified as roundabouts
     """    
-    roundabouts = []
-    for edge in network.edges.itertuples():
-        if pygeos.predicates.is_ring(edge.geometry): roundabouts.append(edge)
-    return roundabouts
+    return network.edges[pygeos.is_ring(network.edges['geometry'].to_numpy())]
 
 
 def clean_roundabouts(network):
@@ -445,74 +492,58 @@ def clean_roundabouts(network):
         network (class): A network composed of nodes (points in space) and edges (lines)
     """    
 
-    sindex = pygeos.STRtree(network.edges['geometry'])
     edges = network.edges
-    new_geom = network.edges
-    new_edge = []
-    remove_edge=[]
-    new_edge_id = []
+    geoms = edges['geometry'].to_numpy()
     attributes = [x for x in network.edges.columns if x not in ['geometry','osm_id']]
 
     roundabouts = find_roundabouts(network)
-    testy = []
-    
-    for roundabout in roundabouts:
-
-        round_bound = pygeos.constructive.boundary(roundabout.geometry)
-        round_centroid = pygeos.constructive.centroid(roundabout.geometry)
-        remove_edge.append(roundabout.Index)
-
-        edges_intersect = _intersects(roundabout.geometry, network.edges['geometry'], sindex)
-        #Drop the roundabout from series so that no snapping happens on it
-        edges_intersect.drop(roundabout.Index,inplace=True)
-        #index at e[0] geometry at e[1] of edges that intersect with 
-        for e in edges_intersect.items():
-            edge = edges.iloc[e[0]]
-            start = pygeom.get_point(e[1],0)
-            end = pygeom.get_point(e[1],-1)
-            first_co_is_closer = pygeos.measurement.distance(end, round_centroid) > pygeos.measurement.distance(start, round_centroid) 
-            #print(first_co_is_closer)
-            #print("start ",start," and end ", end)
-            co_ords = pygeos.coordinates.get_coordinates(edge.geometry)
-            centroid_co = pygeos.coordinates.get_coordinates(round_centroid)
-            #print(type(co_ords))
-            #print(type(centroid_co))
-            if first_co_is_closer: 
-                new_co = np.concatenate((centroid_co,co_ords))
-            else:
-                new_co = np.concatenate((co_ords,centroid_co))
-            snap_line = pygeos.linestrings(new_co)
-
-            snap_line = pygeos.linestrings(new_co)
-            #an edge should never connect to more than 2 roundabouts, if it does this will break
-            if edge.osm_id in new_edge_id:
-                a = []
-                counter = 0
-                for x in new_edge:
-                    if x[0]==edge.osm_id:
-                        a = counter
-                        break
-                    counter += 1
-                double_edge = new_edge.pop(a)
-                start = pygeom.get_point(double_edge[-1],0)
-                end = pygeom.get_point(double_edge[-1],-1)
-                first_co_is_closer = pygeos.measurement.distance(end, round_centroid) > pygeos.measurement.distance(start, round_centroid) 
-                co_ords = pygeos.coordinates.get_coordinates(double_edge[-1])
-                if first_co_is_closer: 
-                    new_co = np.concatenate((centroid_co,co_ords))
-                else:
-                    new_co = np.concatenate((co_ords,centroid_co))
-                snap_line = pygeos.linestrings(new_co)
-                new_edge.append([edge.osm_id]+list(edge[list(attributes)])+[snap_line])
-
-            else:
-                new_edge.append([edge.osm_id]+list(edge[list(attributes)])+[snap_line])
-                new_edge_id.append(edge.osm_id)
-            remove_edge.append(e[0])
-
-    new = pd.DataFrame(new_edge,columns=['osm_id']+attributes+['geometry'])
-    dg = network.edges.loc[~network.edges.index.isin(remove_edge)]
-    
+    round_idx = edges.index.get_indexer(roundabouts.index)
+    round_centroids = pygeos.centroid(geoms[round_idx])
+
+    #all (roundabout, edge) intersecting pairs in one query, without each roundabout itself
+    sindex = network.edge_sindex
+    round_hits, edge_hits = sindex.query_bulk(pygeos.buffer(geoms[round_idx], 1e-9), predicate='intersects')
+    not_self = edge_hits != round_idx[round_hits]
+    round_hits, edge_hits = round_hits[not_self], edge_hits[not_self]
+
+    #edges to snap, in order of first hit, and the position of each pair's edge among them
+    unique_hits, first_hit, pair_edge = np.unique(edge_hits, return_index=True, return_inverse=True)
+    hit_order = np.argsort(first_hit)
+    snapped_idx = unique_hits[hit_order]
+    hit_rank = np.empty_like(hit_order)
+    hit_rank[hit_order] = np.arange(len(hit_order))
+    pair_edge = hit_rank[pair_edge]
+
+    #coordinates of all edges to snap at once, with their start and end
+    coords, coord_edge = pygeos.get_coordinates(geoms[snapped_idx], return_index=True)
+    num_coords = pygeos.get_num_coordinates(geoms[snapped_idx])
+    last_idx = np.cumsum(num_coords)
+    starts = coords[last_idx - num_coords][pair_edge]
+    ends = coords[last_idx - 1][pair_edge]
+    centroid_co = pygeos.get_coordinates(round_centroids)[round_hits]
+
+    #the centroid goes before the first coordinate when that is closer, else after the last
+    d_start = np.hypot(starts[:, 0] - centroid_co[:, 0], starts[:, 1] - centroid_co[:, 1])
+    d_end = np.hypot(ends[:, 0] - centroid_co[:, 0], ends[:, 1] - centroid_co[:, 1])
+    first_co_is_closer = d_end > d_start
+
+    #an edge intersecting two roundabouts is snapped to both, as if one after the other:
+    #sort all coordinates by edge, then prepended / original / appended, then sequence
+    pair_seq = np.arange(len(pair_edge))
+    all_co = np.concatenate((coords, centroid_co))
+    all_edge = np.concatenate((coord_edge, pair_edge))
+    section = np.concatenate((np.ones(len(coords)), np.where(first_co_is_closer, 0, 2)))
+    seq = np.concatenate((np.arange(len(coords)), np.where(first_co_is_closer, -pair_seq, pair_seq)))
+    order = np.lexsort((seq, section, all_edge))
+
+    new = edges.iloc[snapped_idx][['osm_id']+attributes].reset_index(drop=True)
+    new['geometry'] = pygeos.linestrings(all_co[order], indices=all_edge[order])
+
+    remove_edge = np.zeros(len(edges), dtype=bool)
+    remove_edge[round_idx] = True
+    remove_edge[snapped_idx] = True
+    dg = edges.loc[~remove_edge]
+
     ges = pd.concat([dg,new]).reset_index()
 
     return Network(edges=ges, nodes=network.nodes)
@@ -553,11 +584,12 @@ def add_distances(network):
     # formula below based on :https://gis.stackexchange.com/a/190209/80697 
     approximate_crs = "epsg:" + str(int(32700-np.round((45+lat)/90,0)*100+np.round((183+lon)/6,0)))
     #from pygeos/issues/95
-    geometries = network.edges['geometry']
+    geometries = network.edges['geometry'].to_numpy()
     coords = pygeos.get_coordinates(geometries)
-    transformer=pyproj.Transformer.from_crs(current_crs, approximate_crs,always_xy=True)
-    new_coords = transformer.transform(coords[:, 0], coords[:, 1])
-    result = pygeos.set_coordinates(geometries.copy(), np.array(new_coords).T)
+    transformer = _transformer(current_crs, approximate_crs)
+    new_coords = np.empty_like(coords)
+    new_coords[:, 0], new_coords[:, 1] = transformer.transform(coords[:, 0], coords[:, 1], errcheck=False)
+    result = pygeos.set_coordinates(geometries.copy(), new_coords)
     dist = pygeos.length(result)
     edges = network.edges.copy()
     edges['distance'] = dist
@@ -565,6 +597,20 @@ def add_distances(network):
         nodes=network.nodes,
         edges=edges)
 
+@lru_cache(maxsize=None)
+def _transformer(from_crs, to_crs):
+    """Cached pyproj Transformer, these are slow to create and are reused for
+    every network in the same UTM zone
+
+    Args:
+        from_crs (str): [description]
+        to_crs (str): [description]
+
+    Returns:
+        transformer (pyproj.Transformer): [description]
+    """
+    return pyproj.Transformer.from_crs(from_crs, to_crs, always_xy=True)
+
 def add_travel_time(network):
     """Add travel time column to network edges. Time is in hours
 
@@ -575,7 +621,7 @@ def add_travel_time(network):
         network (class): A network composed of nodes (points in space) and edges (lines)
 
     """    
-    if 'distance' not in network.nodes.columns:
+    if 'distance' not in network.edges.columns:
         network = add_distances(network)
     speed_d = {
     'motorway':80000,
@@ -592,14 +638,13 @@ def add_travel_time(network):
     'service':20000,
     'residential': 20000,  # mph
     }
-    def calculate_time(edge):
-        try:
-            return edge['distance'] / speed_d.get(edge['highway'])
-        except:
-             return edge['distance'] / speed_d.get('unclassified')
-           
-
-    network.edges['time'] = network.edges.apply(calculate_time,axis=1)
+    #look up all speeds at once, unknown highway types travel at unclassified speed,
+    #as do lists of types, which cannot be looked up
+    highway = network.edges['highway'].map(lambda hw: hw if isinstance(hw, str) else None)
+    hw_speed = pd.Series(speed_d).reindex(highway).to_numpy()
+    hw_speed = np.where(np.isnan(hw_speed), speed_d['unclassified'], hw_speed)
+
+    network.edges['time'] = network.edges['distance'].to_numpy() / hw_speed
     return network
 
 
@@ -617,8 +662,32 @@ def calculate_degree(network):
     """    
     #the number of nodes(from index) to use as the number of bins
     ndC = len(network.nodes.index)
-    if ndC-1 > max(network.edges.from_id) and ndC-1 > max(network.edges.to_id): print("Calculate_degree possibly unhappy")
-    return np.bincount(network.edges['from_id'],None,ndC) + np.bincount(network.edges['to_id'],None,ndC)
+    if ndC-1 > network.edges.from_id.max() and ndC-1 > network.edges.to_id.max(): print("Calculate_degree possibly unhappy")
+    #every edge adds one to both of its end nodes, so count both id columns in one pass
+    return np.bincount(np.concatenate([network.edges['from_id'].to_numpy(), network.edges['to_id'].to_numpy()]), minlength=ndC)
+
+def build_csr(from_ids, to_ids, n_nodes):
+    """Build a compressed sparse row adjacency of nodes to their edges
+
+    Each edge is listed under both of its nodes, so the incidences of node i are
+    neighbours[indptr[i]:indptr[i+1]] with their edges at the same positions
+    in edge_of_neigh.
+
+    Args:
+        from_ids (numpy.array): from node of each edge
+        to_ids (numpy.array): to node of each edge
+        n_nodes (int): number of nodes
+
+    Returns:
+        indptr, neighbours, edge_of_neigh (numpy.array): [description]
+    """
+    ends = np.concatenate([from_ids, to_ids])
+    others = np.concatenate([to_ids, from_ids])
+    edge_idx = np.tile(np.arange(len(from_ids)), 2)
+    order = np.argsort(ends, kind='stable')
+    indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(ends, minlength=n_nodes))
+    return indptr, others[order], edge_idx[order]
 
 #Adds a degree column to the node dataframe 
 def add_degree(network):
@@ -652,34 +721,18 @@ def drop_hanging_nodes(network, tolerance = 0.005):
     if 'degree' not in network.nodes.columns:
         deg = calculate_degree(network)
     else: deg = network.nodes['degree'].to_numpy()
-    #hangNodes : An array of the indices of nodes with degree 1
-    hangNodes = np.where(deg==1)
     ed = network.edges.copy()
-    to_ids = ed['to_id'].to_numpy()
-    from_ids = ed['from_id'].to_numpy()
-    hangTo = np.isin(to_ids,hangNodes)
-    hangFrom = np.isin(from_ids,hangNodes)
-    #eInd : An array containing the indices of edges that connect
-    #the degree 1 nodes
-    eInd = np.hstack((np.nonzero(hangTo),np.nonzero(hangFrom)))
-    degEd = ed.iloc[np.sort(eInd[0])]
-    edge_id_drop = []
-    for d in degEd.itertuples():
-        dist = pygeos.measurement.length(d.geometry)
-        #If the edge is shorter than the tolerance
-        #add the ID to the drop list and update involved node degrees
-        if dist < tolerance:
-            edge_id_drop.append(d.id)
-            deg[d.from_id] -= 1
-            deg[d.to_id] -= 1
-        # drops disconnected edges, some may still persist since we have not merged yet
-        if deg[d.from_id] == 1 and deg[d.to_id] == 1: 
-            edge_id_drop.append(d.id)
-            deg[d.from_id] -= 1
-            deg[d.to_id] -= 1
-    
-    edg = ed.loc[~(ed.id.isin(edge_id_drop))].reset_index(drop=True)
-    aa = ed.loc[ed.id.isin(edge_id_drop)]
+    to_ids = ed['to_id'].to_numpy().astype(np.int64)
+    from_ids = ed['from_id'].to_numpy().astype(np.int64)
+    #Edges at degree 1 nodes shorter than the tolerance are dropped, then
+    #disconnected edges, some may still persist since we have not merged yet
+    lengths = pygeos.length(ed['geometry'].to_numpy())
+    # the compiled kernel does not check bounds, so check the ids here
+    if len(ed) and max(from_ids.max(), to_ids.max()) >= len(network.nodes):
+        raise IndexError("From or to id out of index, reset the ids first")
+    drop, deg = hanging_cascade(deg.astype(np.int64), from_ids, to_ids, lengths, tolerance)
+
+    edg = ed.loc[~drop].reset_index(drop=True)
     edg.drop(labels=['id'],axis=1,inplace=True)
     edg['id'] = range(len(edg))
     n = network.nodes.copy()
@@ -698,6 +751,9 @@ def merge_edges(network, print_err=False):
     until a node of degree !=2 is found, at this point stop in this direction. Reset the 
     geometry and from/to ids for this edge, delete the nodes and edges traversed. 
 
+    The traversal runs over a node to edge adjacency built from the from and to
+    ids (see build_csr), chains are merged together in one line_merge call.
+
     Args:
         network (class): A network composed of nodes (points in space) and edges (lines)
         print_err (bool, optional): [description]. Defaults to False.
@@ -705,106 +761,52 @@ def merge_edges(network, print_err=False):
     Returns:
         network (class): A network composed of nodes (points in space) and edges (lines)
     """    
-    net = network
-    nod = net.nodes.copy()
-    edg = net.edges.copy()
-    edg_sindex = pygeos.STRtree(network.edges.geometry)
+    nod = network.nodes.copy()
+    edg = network.edges.copy()
+    from_ids = edg['from_id'].to_numpy().astype(np.int64)
+    to_ids = edg['to_id'].to_numpy().astype(np.int64)
+    indptr, neighbours, edge_of_neigh = build_csr(from_ids, to_ids, len(nod))
+    #the adjacency already holds the degree, no need for another pass over the edges
     if 'degree' not in network.nodes.columns:
-        deg = calculate_degree(network)
-    else: deg = nod['degree'].to_numpy()
-    #For the 0.002s speed up, alternatively do a straightforward loc[degree==2]
-    degree2 = np.where(deg==2)
-    #n2: is the set of all node IDs that are degree 2
-    n2 = set((nod['id'].iloc[degree2]))
-    #TODO if you create a dictionary to mask values this geometry
-    #array nodGeom can be made to only contain the 'geometry' of degree 2
-    #nodes
-    nodGeom = nod['geometry']
-    eIDtoRemove =[]
-    nIDtoRemove =[]
-
-    c = 0
-    #pbar = tqdm(total=len(n2))
-    while n2:   
-        newEdge = []
-        info_first_edge = []
-        possibly_delete = []
-        pos_0_deg = []
-        nodeID = n2.pop()
-        pos_0_deg.append(nodeID)
-        #deg[nodeID]= 0
-        #Co-ordinates of current node
-        node_geometry = nodGeom[nodeID]
-        eID = set(edg_sindex.query(nodGeom[nodeID],predicate='intersects'))
-        #Find the nearest 2 edges, unless there is an error in the dataframe
-        #this will return the connected edges using spatial indexing
-        if len(eID) > 2: edgePath1, edgePath2 = find_closest_2_edges(eID,nodeID,edg,node_geometry)
-        elif len(eID) < 2: 
-            #print("First set only contains ", len(eID), "edges")#
-            continue
-        else: 
-            edgePath1 = edg.iloc[eID.pop()]
-            edgePath2 = edg.iloc[eID.pop()] 
-        #For the two edges found, identify the next 2 nodes in either direction    
-        nextNode1 = edgePath1.to_id if edgePath1.from_id==nodeID else edgePath1.from_id
-        nextNode2 = edgePath2.to_id if edgePath2.from_id==nodeID else edgePath2.from_id
-        if nextNode1==nextNode2: continue
-        possibly_delete.append(edgePath2.id)
-        #At the moment the first edge information is used for the merged edge
-        info_first_edge = edgePath1.id
-        newEdge.append(edgePath1.geometry)
-        newEdge.append(edgePath2.geometry)
-        #While the next node along the path is degree 2 keep traversing
-        while deg[nextNode1] == 2:
-            if nextNode1 in pos_0_deg: break
-            eID = set(edg_sindex.query(nodGeom[nextNode1],predicate='intersects'))
-            eID.discard(edgePath1.id)
-            try:
-                edgePath1 = min([edg.iloc[match_idx] for match_idx in eID],
-                key= lambda match: pygeos.distance(nodGeom[nextNode2],(match.geometry)))
-            except: 
-                continue
-            pos_0_deg.append(nextNode1)
-            #deg[nextNode1] = 0
-            n2.discard(nextNode1)
-            nextNode1 = edgePath1.to_id if edgePath1.from_id==nextNode1 else edgePath1.from_id
-            newEdge.append(edgePath1.geometry)
-            possibly_delete.append(edgePath1.id)
-
-        while deg[nextNode2] == 2:
-            if nextNode2 in pos_0_deg: break
-            eID = set(edg_sindex.query(nodGeom[nextNode2],predicate='intersects'))
-            eID.discard(edgePath2.id)
-            try:
-                edgePath2 = min([edg.iloc[match_idx] for match_idx in eID],
-                key= lambda match: pygeos.distance(nodGeom[nextNode2],(match.geometry)))
-            except: continue
-            pos_0_deg.append(nextNode2)
-            #deg[nextNode2] = 0
-            n2.discard(nextNode2)
-            nextNode2 = edgePath2.to_id if edgePath2.from_id==nextNode2 else edgePath2.from_id
-            newEdge.append(edgePath2.geometry)
-            possibly_delete.append(edgePath2.id)
-        #Update the information of the first edge
-        new_merged_geom = pygeos.line_merge(pygeos.multilinestrings([x for x in newEdge]))
-        if pygeom.get_type_id(new_merged_geom) == 1: 
-            edg.at[info_first_edge,'geometry'] = new_merged_geom
-            edg.at[info_first_edge,'from_id'] = nextNode1
-            edg.at[info_first_edge,'to_id'] = nextNode2
-            eIDtoRemove += possibly_delete
-            for x in pos_0_deg:
-                deg[x] = 0
-        else:
-            if print_err: print("Line", info_first_edge, "failed to merge, has pygeos type ", pygeom.get_type_id(edg.at[info_first_edge,'geometry']))
-
-        #pbar.update(1)
-    
-    #pbar.close()
-    edg = edg.loc[~(edg.id.isin(eIDtoRemove))].reset_index(drop=True)
+        deg = np.diff(indptr)
+    else: deg = nod['degree'].to_numpy().copy()
+    chain_edges, edge_ptr, chain_nodes, node_ptr, chain_ends = walk_deg2_chains(
+        indptr, neighbours, edge_of_neigh, deg)
+
+    #Merge the geometries of all chains at once, grouped by chain
+    n_chains = len(chain_ends)
+    edge_counts = np.diff(edge_ptr)
+    edge_group = np.repeat(np.arange(n_chains), edge_counts)
+    edge_geoms = edg['geometry'].to_numpy()
+    merged = pygeos.line_merge(pygeos.multilinestrings(edge_geoms[chain_edges], indices=edge_group))
+    merged_ok = pygeos.get_type_id(merged) == 1
+
+    #At the moment the first edge information is used for the merged edge
+    first_edges = chain_edges[edge_ptr[:-1]]
+    if print_err:
+        for i in np.flatnonzero(~merged_ok):
+            print("Line", edg['id'].iat[first_edges[i]], "failed to merge, has pygeos type ", pygeom.get_type_id(merged[i]))
+
+    #Update the information of the first edge
+    edge_geoms = edge_geoms.copy()
+    edge_geoms[first_edges[merged_ok]] = merged[merged_ok]
+    from_ids[first_edges[merged_ok]] = chain_ends[merged_ok, 0]
+    to_ids[first_edges[merged_ok]] = chain_ends[merged_ok, 1]
+    edg['geometry'] = edge_geoms
+    edg['from_id'] = from_ids
+    edg['to_id'] = to_ids
+
+    #All other edges of a merged chain are removed, and its inner nodes set to degree 0
+    remove_edge = np.zeros(len(edg), dtype=bool)
+    remove_edge[chain_edges[merged_ok[edge_group]]] = True
+    remove_edge[first_edges] = False
+    deg[chain_nodes[np.repeat(merged_ok, np.diff(node_ptr))]] = 0
+
+    edg = edg.loc[~remove_edge].reset_index(drop=True)
 
     #We remove all degree 0 nodes, including those found in dropHanging
+    nod['degree'] = deg
     n = nod.loc[nod.degree > 0].reset_index(drop=True)
-    #n=nod.reset_index(drop=True)
     return Network(nodes=n,edges=edg)
 
 def find_closest_2_edges(edgeIDs, nodeID, edges, nodGeometry):
@@ -819,12 +821,11 @@ def find_closest_2_edges(edgeIDs, nodeID, edges, nodGeometry):
     Returns:
         [type]: [description]
     """    
-    edgePath1 = min([edges.iloc[match_idx] for match_idx in edgeIDs],
-            key=lambda match: pygeos.distance(nodGeometry,match.geometry))
-    edgeIDs.remove(edgePath1.id)
-    edgePath2 = min([edges.iloc[match_idx] for match_idx in edgeIDs],
-            key=lambda match:  pygeos.distance(nodGeometry,match.geometry))
-    return edgePath1, edgePath2
+    edge_idx = np.fromiter(edgeIDs, dtype=np.int64, count=len(edgeIDs))
+    dists = pygeos.distance(nodGeometry, edges['geometry'].to_numpy()[edge_idx])
+    #kth=1 puts the two smallest distances first, in order
+    closest = edge_idx[np.argpartition(dists, 1)[:2]]
+    return edges.iloc[closest[0]], edges.iloc[closest[1]]
 
 def geometry_column_name(df):
     """Get geometry column name, fall back to 'geometry'
@@ -887,10 +888,17 @@ def node_connectivity_degree(node, network):
             ]
     )
 
+def _xy_keys(coords):
+    """View an (n, 2) coordinate array as n (x, y) records, so pairs can be
+    compared, sorted and looked up as single values
+    """
+    return np.ascontiguousarray(coords, dtype='f8').view([('x', 'f8'), ('y', 'f8')]).ravel()
+
 def drop_duplicate_geometries(df, keep='first'):
     """Drop duplicate geometries from a dataframe
 
-    Convert to wkb so drop_duplicates will work as discussed 
+    Point geometries are compared on their x, y coordinates directly. Anything
+    else is converted to wkb so duplicated will work as discussed
     in https://github.com/geopandas/geopandas/issues/521
 
     Args:
@@ -899,11 +907,24 @@ def drop_duplicate_geometries(df, keep='first'):
 
     Returns:
         [type]: [description]
-    """    
-
-    mask = df.geometry.apply(lambda geom: pygeos.to_wkb(geom))
-    # use dropped duplicates index to drop from actual dataframe
-    return df.iloc[mask.drop_duplicates(keep).index]
+    """
+    geoms = df.geometry.values
+    # 0 is POINT, missing or empty points have no coordinates so take the wkb path
+    if (pygeos.get_type_id(geoms) == 0).all() and not pygeos.is_empty(geoms).any():
+        #compare each x, y pair as one record, without serialising
+        keys = _xy_keys(pygeos.get_coordinates(geoms))
+        if keep == 'last':
+            keys = keys[::-1]
+        _, first_idx, counts = np.unique(keys, return_index=True, return_counts=True)
+        if keep is False:
+            first_idx = first_idx[counts == 1]
+        if keep == 'last':
+            first_idx = len(keys) - 1 - first_idx
+        unique = np.zeros(len(keys), dtype=bool)
+        unique[first_idx] = True
+        return df[unique]
+    duplicated = pd.Series(pygeos.to_wkb(geoms)).duplicated(keep=keep)
+    return df[~duplicated.to_numpy()]
 
 def nearest_point_on_edges(point, edges):
     """Find nearest point on edges to a point
@@ -957,37 +978,42 @@ def nearest(geom, df,sindex):
         [type]: [description]
     """    
     matches_idx = sindex.query(geom)
-    nearest_geom = min(
-        [df.iloc[match_idx] for match_idx in matches_idx],
-        key=lambda match: pygeos.measurement.distance(match.geometry,geom)
-    )
-    return nearest_geom
+    dists = pygeos.measurement.distance(df[geometry_column_name(df)].to_numpy()[matches_idx], geom)
+    return df.iloc[matches_idx[dists.argmin()]]
 
-def edges_within(point, edges, distance):
+def edges_within(point, edges, distance, sindex=None):
     """Find edges within a distance of point
 
     Args:
         point (pygeos.geometry): [description]
         edges (network.edges): [description]
         distance ([type]): [description]
+        sindex (pygeos.STRtree, optional): Spatial index of the edges, e.g. network.edge_sindex. Defaults to None.
 
     Returns:
         [type]: [description]
     """    
-    return d_within(point, edges, distance)
+    return d_within(point, edges, distance, sindex)
 
-def d_within(geom, df, distance):
+def d_within(geom, df, distance, sindex=None):
     """Find the subset of a DataFrame within some distance of a shapely geometry
 
     Args:
         geom (pygeos.geometry): [description]
         df (pandas.DataFrame): [description]
         distance ([type]): [description]
+        sindex (pygeos.STRtree, optional): Spatial index of df, to query for repeated
+            calls. Defaults to None, to measure against all of df in one pass.
 
     Returns:
         [type]: [description]
     """    
-    return _intersects(geom, df, distance)
+    if sindex is not None:
+        return _intersects(geom, df, sindex, distance)
+    geoms = df[geometry_column_name(df)].to_numpy()
+    if HAS_DWITHIN:
+        return df[pygeos.dwithin(geoms, geom, distance)]
+    return df[pygeos.distance(geoms, geom) <= distance]
 
 def _intersects(geom, df, sindex,tolerance=1e-9):
     """[summary]
@@ -1001,17 +1027,33 @@ def _intersects(geom, df, sindex,tolerance=1e-9):
     Returns:
         [type]: [description]
     """    
+    if HAS_DWITHIN:
+        # query by distance, without building a buffer geometry
+        return df.iloc[_dwithin(geom, sindex, tolerance)]
     buffer = pygeos.buffer(geom,tolerance)
     if pygeos.is_empty(buffer):
         # can have an empty buffer with too small a tolerance, fallback to original geom
         buffer = geom
     try:
         return _intersects_df(buffer, df,sindex)
-    except: 
+    except pygeos.GEOSException: 
         # can exceptionally buffer to an invalid geometry, so try re-buffering
         buffer = pygeos.buffer(geom,0)
         return _intersects_df(buffer, df,sindex)
   
+def _dwithin(geom, sindex, tolerance):
+    """Find the indices of the geometries in sindex within tolerance of geom
+
+    Args:
+        geom (pygeos.geometry): [description]
+        sindex (pygeos.STRtree): [description]
+        tolerance (float): [description]
+
+    Returns:
+        numpy.array: indices into the geometries of sindex
+    """    
+    return sindex.query(geom, predicate='dwithin', distance=tolerance)
+
 def _intersects_df(geom, df,sindex):
     """[summary]
 
@@ -1023,7 +1065,7 @@ def _intersects_df(geom, df,sindex):
     Returns:
         [type]: [description]
     """    
-    return df[sindex.query(geom,'intersects')]
+    return df.iloc[sindex.query(geom,'intersects')]
 
 def intersects(geom, df, sindex, tolerance=1e-9):
     """Find the subset of a GeoDataFrame intersecting with a shapely geometry
@@ -1082,8 +1124,12 @@ def split_edge_at_points(edge, points, tolerance=1e-9):
     except ValueError:
         # if splitting fails, e.g. becuase points is empty GeometryCollection
         segments = [edge.geometry]
-    edges = DataFrame([edge] * len(segments))
-    edges.geometry = segments
+    # repeat each attribute once per segment, then set all segments at once
+    n = len(segments)
+    # [value] * n keeps list valued attributes, e.g. osm tags, whole
+    edges = DataFrame({col: [value] * n for col, value in edge.items()},
+                      index=[edge.name] * n)
+    edges['geometry'] = segments
     return edges
 
 def split_line(line, points, tolerance=1e-9):
@@ -1098,11 +1144,22 @@ def split_line(line, points, tolerance=1e-9):
         [type]: [description]
     """    
     to_split = snap_line(line, points, tolerance)
-    return list(split(to_split, points))
+    # the points are now vertices of the line, so cut it at those vertices
+    coords = pygeos.get_coordinates(to_split)
+    if len(coords) == 0:
+        # missing or empty line, nothing to split
+        return [line]
+    is_split = np.isin(_xy_keys(coords), _xy_keys(pygeos.get_coordinates(points)))
+    is_split[[0, -1]] = True
+    split_locs = np.flatnonzero(is_split)
+    return [pygeos.linestrings(coords[start:end + 1]) for start, end in zip(split_locs[:-1], split_locs[1:])]
 
 def snap_line(line, points, tolerance=1e-9):
     """Snap a line to points within tolerance, inserting vertices as necessary
 
+    All vertices are inserted in one rebuild of the line, points going into the
+    same segment are ordered along it.
+
     Args:
         line (pygeos.geometry): [description]
         points (pygeos.geometry): [description]
@@ -1111,14 +1168,104 @@ def snap_line(line, points, tolerance=1e-9):
     Returns:
         [type]: [description]
     """    
-    if  pygeom.get_type_id(edge.geometry) == 0:
-        if pygeos.distance(point,line) < tolerance:
-            line = pygeos.snap(line, points, tolerance=1e-9)
-    elif pygeom.get_type_id(edge.geometry) == 4:
-        points = [point for point in points if pygeos.distance(point,line) < tolerance]
-        for point in points:
-            line = pygeos.snap(line, points, tolerance=1e-9)
-    return line
+    #get_coordinates gives the point itself for a point, or the points of a multipoint
+    point_coords = pygeos.get_coordinates(points)
+    #the same point twice is only inserted once
+    _, first_idx = np.unique(_xy_keys(point_coords), return_index=True)
+    point_coords = point_coords[np.sort(first_idx)]
+
+    coords = pygeos.get_coordinates(line)
+    insert_idx, seg_pos, dist, on_vertex = _vertex_insert_positions(coords, point_coords, tolerance)
+    insert = ~on_vertex & (dist < tolerance)
+    if not insert.any():
+        return line
+    insert_idx, seg_pos, point_coords = insert_idx[insert], seg_pos[insert], point_coords[insert]
+    order = np.lexsort((seg_pos, insert_idx))
+    return pygeos.linestrings(np.insert(coords, insert_idx[order], point_coords[order], axis=0))
+
+def add_vertex(line, point):
+    """Add a vertex to a line at a point
+
+    Args:
+        line (pygeos.geometry): [description]
+        point (pygeos.geometry): [description]
+
+    Returns:
+        [type]: [description]
+    """    
+    coords = pygeos.get_coordinates(line)
+    point_coords = pygeos.get_coordinates(point)
+    insert_idx, _, _, on_vertex = _vertex_insert_positions(coords, point_coords)
+    if on_vertex[0]:
+        # point could already be a vertex, so return unchanged
+        return line
+    return pygeos.linestrings(np.insert(coords, insert_idx[0], point_coords[0], axis=0))
+
+def _vertex_insert_positions(coords, point_coords, tolerance=None):
+    """Find where points go into the coordinates of a line
+
+    Each point goes into the segment it is nearest to, the first one if several
+    are as near, found through a spatial index of the segments.
+
+    Args:
+        coords (numpy.array): (n, 2) coordinates of the line
+        point_coords (numpy.array): (k, 2) coordinates of the points
+        tolerance (float, optional): only look for segments within this distance
+            of each point, points without any are at an infinite distance. Defaults
+            to None, to find the nearest segment however far.
+
+    Returns:
+        insert_idx (numpy.array): index in coords to insert each point before
+        seg_pos (numpy.array): position of each point along its segment, from 0 to 1
+        dist (numpy.array): distance from each point to the line
+        on_vertex (numpy.array): whether each point already is a vertex of the line
+    """
+    n_points, n_segs = len(point_coords), len(coords) - 1
+    insert_idx = np.zeros(n_points, dtype=np.int64)
+    seg_pos = np.zeros(n_points)
+    dist = np.full(n_points, np.inf)
+    on_vertex = np.isin(_xy_keys(point_coords), _xy_keys(coords))
+    if n_points == 0 or n_segs < 1:
+        return insert_idx, seg_pos, dist, np.ones(n_points, dtype=bool)
+
+    segments = pygeos.linestrings(np.stack([coords[:-1], coords[1:]], axis=1))
+    sindex = pygeos.STRtree(segments)
+    points = pygeos.points(point_coords)
+    if tolerance is None:
+        point_idx, seg_idx = sindex.nearest_all(points)
+    elif HAS_DWITHIN:
+        point_idx, seg_idx = sindex.query_bulk(points, predicate='dwithin', distance=tolerance)
+    else:
+        point_idx, seg_idx = sindex.query_bulk(pygeos.buffer(points, tolerance), predicate='intersects')
+
+    # keep the nearest candidate segment of each point, the first along the line of equally near ones
+    pair_dist, pair_pos = _segment_distance(point_coords[point_idx], coords[seg_idx], coords[seg_idx + 1])
+    order = np.lexsort((seg_idx, pair_dist, point_idx))
+    _, first = np.unique(point_idx[order], return_index=True)
+    nearest = order[first]
+    found = point_idx[nearest]
+
+    # inserting before i + 1 puts a point into the segment from i to i + 1
+    insert_idx[found] = seg_idx[nearest] + 1
+    seg_pos[found] = pair_pos[nearest]
+    dist[found] = pair_dist[nearest]
+    return insert_idx, seg_pos, dist, on_vertex
+
+def _segment_distance(points, starts, ends):
+    """Distance from points to segments, and the position of the nearest point
+    along each segment from 0 at the start to 1 at the end
+
+    Args:
+        points, starts, ends (numpy.array): (k, 2) coordinates
+
+    Returns:
+        dist, pos (numpy.array): [description]
+    """
+    seg = ends - starts
+    seg_len2 = (seg ** 2).sum(axis=1)
+    pos = np.clip(((points - starts) * seg).sum(axis=1) / np.where(seg_len2 > 0, seg_len2, 1), 0, 1)
+    dist = np.hypot(*(points - (starts + pos[:, None] * seg)).T)
+    return dist, pos
 
 def nearest_point_on_line(point, line):
     """Return the nearest point on a line
@@ -1133,18 +1280,19 @@ def nearest_point_on_line(point, line):
     return line.interpolate(line.project(point))
 
 def set_precision(geom, precision):
-    """Set geometry precision
+    """Set geometry precision by rounding every coordinate to some number of decimals
+
+    Works on a single geometry or an array of geometries, all coordinates are
+    rounded in one numpy call.
 
     Args:
-        geom (pygeos.geometry): [description]
+        geom (pygeos.geometry or array of pygeos.geometry): [description]
         precision ([type]): [description]
 
     Returns:
         [type]: [description]
     """    
-    geom_mapping = mapping(geom)
-    geom_mapping['coordinates'] = np.round(np.array(geom_mapping['coordinates']), precision)
-    return shape(geom_mapping)
+    return pygeos.apply(geom, lambda coords: np.round(coords, precision))
 
 def reset_ids(network):
     """Resets the ids of the nodes and edges, editing the refereces in edge table 
@@ -1156,28 +1304,22 @@ def reset_ids(network):
     Returns:
         [type]: [description]
     """    
-    nodes = network.nodes.copy()
-    edges = network.edges.copy()
-    to_ids =  edges['to_id'].to_numpy()
-    from_ids = edges['from_id'].to_numpy()
-    new_node_ids = range(len(nodes))
-    #creates a dictionary of the node ids and the actual indices
-    id_dict = dict(zip(nodes.id,new_node_ids))
-    nt = np.copy(to_ids)
-    nf = np.copy(from_ids) 
-    #updates all from and to ids, because many nodes are effected, this
-    #is quite optimal approach for large dataframes
-    for k,v in id_dict.items():
-        nt[to_ids==k] = v
-        nf[from_ids==k] = v
-    edges.drop(labels=['to_id','from_id'],axis=1,inplace=True)
+    to_ids =  network.edges['to_id'].to_numpy()
+    from_ids = network.edges['from_id'].to_numpy()
+    #updates all from and to ids to the position of their node, with one sorted
+    #lookup instead of a pass over the edges per node
+    nt = remap_ids(to_ids, network.nodes['id'].to_numpy())
+    nf = remap_ids(from_ids, network.nodes['id'].to_numpy())
+    #drop returns the only copy made of each table, the id columns are added
+    #to it and the index is replaced without copying again
+    edges = network.edges.drop(labels=['to_id','from_id'],axis=1)
     edges['from_id'] = nf
     edges['to_id'] = nt
-    nodes.drop(labels=['id'],axis=1,inplace=True)
-    nodes['id'] = new_node_ids
     edges['id'] = range(len(edges))
-    edges.reset_index(drop=True,inplace=True)
-    nodes.reset_index(drop=True,inplace=True)
+    edges.index = pd.RangeIndex(len(edges))
+    nodes = network.nodes.drop(labels=['id'],axis=1)
+    nodes['id'] = range(len(nodes))
+    nodes.index = pd.RangeIndex(len(nodes))
     return Network(edges=edges,nodes=nodes)
 
 def split_edges_at_nodes(network, tolerance=1e-9):
@@ -1190,28 +1332,47 @@ def split_edges_at_nodes(network, tolerance=1e-9):
     Returns:
         [type]: [description]
     """    
-    sindex_edges = pygeos.STRtree(network.edges['geometry'])
+    edge_geoms = network.edges['geometry'].to_numpy()
+    sindex_edges = network.edge_sindex
     
     attributes = [x for x in network.edges.columns if x not in ['index','geometry','osm_id']]
 
+    #query all edges against each other at once, without each edge itself
+    if HAS_DWITHIN:
+        edge_idx, hit_idx = sindex_edges.query_bulk(edge_geoms, predicate='dwithin', distance=tolerance)
+    else:
+        edge_idx, hit_idx = sindex_edges.query_bulk(pygeos.buffer(edge_geoms, tolerance), predicate='intersects')
+    not_self = edge_idx != hit_idx
+    edge_idx, hit_idx = edge_idx[not_self], hit_idx[not_self]
+
+    #intersect all pairs at once, dropping overlaps that cover the whole edge
+    hits_all = pygeos.intersection(edge_geoms[edge_idx], edge_geoms[hit_idx])
+    partial = ~pygeos.covers(hits_all, edge_geoms[edge_idx])
+    edge_idx, hits_all = edge_idx[partial], hits_all[partial]
+
+    #take the coordinates of all intersections in one go, then drop repeated
+    #coordinates per edge and group them by edge, sorting on (edge, x, y)
+    hit_coords, coord_idx = pygeos.get_coordinates(hits_all, return_index=True)
+    keyed = np.unique(np.column_stack([edge_idx[coord_idx], hit_coords]), axis=0)
+    hit_edge = keyed[:, 0].astype(np.int64)
+
+    #snap all points to the vertices of their edge in one call
+    split_coords = pygeos.get_coordinates(pygeos.snap(pygeos.points(keyed[:, 1:]), edge_geoms[hit_edge], tolerance=1e-9))
+    split_groups = np.split(split_coords, np.searchsorted(hit_edge, np.arange(1, len(edge_geoms))))
+
     grab_all_edges = []
-    new_nodes = []
-    for edge in tqdm(network.edges.itertuples(index=False), desc="split", total=len(network.edges)):
-        hits_edges = nodes_intersecting(edge.geometry,network.edges['geometry'],sindex_edges, tolerance=1e-9)
-        hits_edges = pygeos.set_operations.intersection(edge.geometry,hits_edges)
-        hits_edges = (hits_edges[~(pygeos.predicates.covers(hits_edges,edge.geometry))])
-        hits_edges = pd.Series([pygeos.points(item) for sublist in [pygeos.get_coordinates(x) for x in hits_edges] for item in sublist],name='geometry')
-        hits = [pygeos.points(x) for x in pygeos.coordinates.get_coordinates(
-            pygeos.constructive.extract_unique_points(hits_edges.values))]#pygeos.multipoints(hits_edges.values)))]#pd.concat([hits_nodes,hits_edges]).values)))]
-        
-        hits = pd.DataFrame(hits,columns=['geometry'])    
-        
-        # get points and geometry as list of coordinates
-        split_points = pygeos.coordinates.get_coordinates(pygeos.snap(hits,edge.geometry,tolerance=1e-9))
+    for edge, split_points in zip(network.edges.itertuples(index=False), split_groups):
+        # get geometry as list of coordinates
         coor_geom = pygeos.coordinates.get_coordinates(edge.geometry)
+        if len(coor_geom) == 0:
+            # missing or empty geometry, nothing to split so drop the edge
+            continue
  
         # potentially split to multiple edges
-        split_locs = np.argwhere(np.isin(coor_geom, split_points).all(axis=1))[:,0]
+        #the edge always starts and ends a piece, dangling ends included
+        is_split = np.isin(_xy_keys(coor_geom), _xy_keys(split_points))
+        is_split[[0, -1]] = True
+        split_locs = np.flatnonzero(is_split)
         split_locs = list(zip(split_locs.tolist(), split_locs.tolist()[1:]))
 
         new_edges = [coor_geom[split_loc[0]:split_loc[1]+1] for split_loc in split_locs]
@@ -1268,15 +1429,24 @@ def add_modal(network,alter_transport,threshold=0.02):
     edges = network.edges.copy()
     nodes = network.nodes.copy()
     node_degree = nodes.degree.to_numpy()
-    sindex_nodes = pygeos.STRtree(nodes['geometry'])
-    sindex_edges = pygeos.STRtree(edges['geometry'])
+    sindex_edges = network.edge_sindex
+    #plain arrays for the lookups in the loop below
+    edge_geoms = edges['geometry'].to_numpy()
+    edge_ids = edges['id'].to_numpy()
+    from_ids = edges['from_id'].to_numpy()
+    to_ids = edges['to_id'].to_numpy()
+    node_geoms = nodes['geometry'].to_numpy()
+    node_coords = pygeos.get_coordinates(node_geoms)
+    #start and end points and coordinates of all routes at once
+    route_geoms = alter_transport['geometry'].to_numpy()
+    route_starts = pygeom.get_point(route_geoms,0)
+    route_ends = pygeom.get_point(route_geoms,-1)
+    route_coords, route_idx = pygeos.get_coordinates(route_geoms, return_index=True)
+    route_coords = np.split(route_coords, np.searchsorted(route_idx, np.arange(1, len(route_geoms))))
     new_edges = []
     edge_id_counter = len(edges)
     counter = 0
-    for route in alter_transport.itertuples():
-        route_geom = route.geometry
-        start = pygeom.get_point(route_geom,0)
-        end = pygeom.get_point(route_geom,-1)
+    for route, start, end, coords in zip(alter_transport.itertuples(), route_starts, route_ends, route_coords):
 
         near_start = _intersects(start,edges['geometry'],sindex_edges, tolerance=threshold)
         near_end = _intersects(end,edges['geometry'],sindex_edges, tolerance=threshold)
@@ -1287,38 +1457,29 @@ def add_modal(network,alter_transport,threshold=0.02):
         if len(near_start) < 1 or len(near_end) < 1: continue
 
         if len(near_start) > 1: 
-            near_start = min([edges.iloc[match_idx] for match_idx in near_start],
-                key=lambda match: pygeos.distance(start,match.geometry))
-            near_start = near_start.id
+            near_start = edge_ids[near_start[pygeos.distance(start, edge_geoms[near_start]).argmin()]]
 
-        else: near_start = edges.id.iloc[near_start[0]]
+        else: near_start = edge_ids[near_start[0]]
         if len(near_end) > 1: 
-            near_end = min([edges.iloc[match_idx] for match_idx in near_end],
-                key=lambda match: pygeos.distance(end,match.geometry))
-            near_end=near_end.id
-        else: near_end = edges.id.iloc[near_end[0]]
+            near_end = edge_ids[near_end[pygeos.distance(end, edge_geoms[near_end]).argmin()]]
+        else: near_end = edge_ids[near_end[0]]
         if near_end==near_start: 
             print("for counter ", counter, "we skipped")
             continue
         #pick nodes to create edge
-        near_start = edges.iloc[near_start]
-        near_end = edges.iloc[near_end]
-        new_line_start = pygeos.coordinates.get_coordinates(route_geom)
-
-        from_is_closer = pygeos.measurement.distance(start, nodes.iloc[near_start.from_id].geometry) < pygeos.measurement.distance(start, nodes.iloc[near_start.to_id].geometry)
-        if from_is_closer:
-            start_id = near_start.from_id
+        start_dists = pygeos.measurement.distance(start, node_geoms[[from_ids[near_start], to_ids[near_start]]])
+        if start_dists[0] < start_dists[1]:
+            start_id = from_ids[near_start]
         else:
-            start_id = near_start.to_id
+            start_id = to_ids[near_start]
         node_degree[start_id] += 1
-        new_line = np.concatenate((pygeos.coordinates.get_coordinates(nodes.iloc[start_id].geometry),new_line_start))
-        from_is_closer = pygeos.measurement.distance(end, nodes.iloc[near_end.from_id].geometry) < pygeos.measurement.distance(end, nodes.iloc[near_end.to_id].geometry)
-        if from_is_closer:
-            end_id = near_end.from_id
+        end_dists = pygeos.measurement.distance(end, node_geoms[[from_ids[near_end], to_ids[near_end]]])
+        if end_dists[0] < end_dists[1]:
+            end_id = from_ids[near_end]
         else:
-            end_id = near_end.to_id
+            end_id = to_ids[near_end]
         node_degree[end_id] += 1
-        new_line = np.concatenate((new_line,pygeos.coordinates.get_coordinates(nodes.iloc[end_id].geometry)))
+        new_line = np.concatenate((node_coords[[start_id]], coords, node_coords[[end_id]]))
         new_edges.append({'osm_id':route.osm_id,'geometry': pygeos.linestrings(new_line),'highway':route.highway,'id':edge_id_counter,'from_id':start_id,'to_id':end_id,'distance':999,'time':999})
 
         counter+=1
@@ -1328,23 +1489,26 @@ def add_modal(network,alter_transport,threshold=0.02):
     return Network(edges = edges, nodes=nodes)
 
 def logicCheck(net):
-    nodes = net.nodes.copy()
-    edges = net.edges.copy()
+    nodes = net.nodes
+    edges = net.edges
 
     indexRef=False
     eID = []
     nID = []
-    if max(edges.from_id) > max(nodes.id) or max(edges.to_id) > max(nodes.id):
+    from_ids = edges.from_id.to_numpy()
+    to_ids = edges.to_id.to_numpy()
+    max_node_id = nodes.id.max()
+    if from_ids.max() > max_node_id or to_ids.max() > max_node_id:
         print("ERROR: From or to id out of index")
-        print("max node id: ", max(nodes.id))
-        print("max from id: ", max(edges.from_id))
-        print("max to id: ", max(edges.to_id))
+        print("max node id: ", max_node_id)
+        print("max from id: ", from_ids.max())
+        print("max to id: ", to_ids.max())
 
     cur_deg = nodes['degree'].to_numpy()
     cal_deg = ['1','2']
     try:
-        cal_deg = calculate_degree(net)
-    except: print("ERROR: Degree could not be calculated from from and to ids")
+        cal_deg = np.bincount(np.concatenate([from_ids, to_ids]), minlength=len(nodes))
+    except (TypeError, ValueError): print("ERROR: Degree could not be calculated from from and to ids")
 
     if not np.array_equal(cur_deg,cal_deg): print("Final node degree values do not correspond to edge dataframe")
 
@@ -1359,13 +1523,12 @@ def logicCheck(net):
         print("ERROR: Saving as geopackage did not work. Check if package is correctly installed and/or if geometries all all the same type")
 
 def findMulti(net):
-    edges = net.edges.copy()
-    multi = []
-    for edge in edges.itertuples():
-        if pygeom.get_type_id(edge.geometry) == '5':
-            multi.append(edge.id)
-    line = edges.loc[~edges.id.isin(multi)]
-    multiline = edges.loc[edges.id.isin(multi)]
+    edges = net.edges
+    # 5 is MULTILINESTRING
+    is_multi = pygeos.get_type_id(edges['geometry'].to_numpy()) == 5
+    multi = edges.id.to_numpy()[is_multi]
+    line = edges.loc[~is_multi]
+    multiline = edges.loc[is_multi]
     #try:
      #   with Geopackage('multi.gpkg', 'w') as out:
       #      out.add_layer(line, name='l', crs='EPSG:4326')
@@ -1375,23 +1538,15 @@ def findMulti(net):
 
 
 def quickFix(net):
-    edges = net.edges.copy()
-    a = []
-    rem = []
-    for edge in edges.itertuples():
-        if not pygeos.get_num_geometries(edge.geometry) == 1:
-            b = pygeos.get_num_geometries(edge.geometry)
-            print("Multiple geometries in edge id: ", edge.id)
-            for x in range(b):
-                a.append(pygeom.get_geometry(edge.geometry,x)) 
-           
-            rem.append(edge.id)
-        if edge.from_id > max(net.nodes.id) or edge.to_id > max(net.nodes.id):
-            rem.append(edge.id)
-    edges = edges.loc[~edges.id.isin(rem)]
+    edges = net.edges
+    #edges made of several geometries, or referencing nodes that do not exist
+    multi = pygeos.get_num_geometries(edges['geometry'].to_numpy()) != 1
+    for edge_id in edges.id[multi]:
+        print("Multiple geometries in edge id: ", edge_id)
+    max_node_id = net.nodes.id.max()
+    rem = multi | (edges.from_id.to_numpy() > max_node_id) | (edges.to_id.to_numpy() > max_node_id)
+    edges = edges.loc[~edges.id.isin(edges.id[rem])].reset_index(drop=True)
     edges['id'] = range(len(edges))
-    edges.reset_index(drop=True,inplace=True)
-    #a should have the individual linestrings in it 
     return Network(edges=edges,nodes=net.nodes)
 
 #Creates an igraph from geodataframe with the distances as weights. 
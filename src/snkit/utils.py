@@ -1,7 +1,40 @@
 """Generic utilities
 """
+import numpy as np
+
 
 def tqdm_standin(iterator, *_, **__):
     """Alternative to tqdm, with no progress bar - ignore any arguments after the first
     """
     return iterator
+
+
+def njit_standin(*args, **__):
+    """Alternative to numba.njit, with no compilation - ignore any options
+    """
+    if len(args) == 1 and callable(args[0]):
+        return args[0]
+    return lambda func: func
+
+
+def remap_ids(ids, old_ids):
+    """Map ids to the position of the matching id in old_ids - ids not found in
+    old_ids are left as they are, repeated old_ids map to their last position
+
+    Args:
+        ids (numpy.array): ids to map, e.g. the from or to ids of edges
+        old_ids (numpy.array): current ids, e.g. the ids of nodes
+
+    Returns:
+        numpy.array: positions in old_ids
+    """
+    ids = np.asarray(ids)
+    old_ids = np.asarray(old_ids)
+    if len(old_ids) == 0:
+        return ids.copy()
+    order = np.argsort(old_ids, kind='stable')
+    sorted_old = old_ids[order]
+    pos = np.searchsorted(sorted_old, ids, side='right') - 1
+    pos_c = np.clip(pos, 0, None)
+    found = (pos >= 0) & (sorted_old[pos_c] == ids)
+    return np.where(found, order[pos_c], ids)
@@ -0,0 +1,608 @@
+"""Test network simplification on pygeos geometries
+"""
+# pylint: disable=C0103
+import numpy as np
+import pandas as pd
+import pygeos
+from pytest import fixture, raises
+
+import snkit.simplify
+
+
+@fixture
+def split_with_ids():
+    """T-junction with nodes, long edge split, and node and edge ids:
+      b
+     1| 2
+      c---d
+     0|
+      a
+    """
+    a = pygeos.points(0, 0)
+    b = pygeos.points(0, 2)
+    c = pygeos.points(0, 1)
+    d = pygeos.points(1, 1)
+    nodes = pd.DataFrame(data={
+        'geometry': [a, b, c, d],
+        'id': [0, 1, 2, 3]
+    })
+    ac = pygeos.linestrings([(0, 0), (0, 1)])
+    cb = pygeos.linestrings([(0, 1), (0, 2)])
+    cd = pygeos.linestrings([(0, 1), (1, 1)])
+    edges = pd.DataFrame(data={
+        'geometry': [ac, cb, cd],
+        'id': [0, 1, 2]
+    })
+    return snkit.simplify.Network(edges=edges, nodes=nodes)
+
+
+def test_add_topology(split_with_ids):
+    """Should set from_id and to_id from the nodes at edge endpoints
+    """
+    topo = snkit.simplify.add_topology(split_with_ids)
+    assert list(topo.edges.from_id) == [0, 2, 2]
+    assert list(topo.edges.to_id) == [2, 1, 3]
+
+
+def test_add_topology_drops_unconnected(split_with_ids):
+    """Should drop edges with an endpoint away from any node
+    """
+    edges = split_with_ids.edges.copy()
+    edges.loc[3] = [pygeos.linestrings([(1, 1), (2, 2)]), 3]
+    network = snkit.simplify.Network(edges=edges, nodes=split_with_ids.nodes)
+    topo = snkit.simplify.add_topology(network)
+    assert list(topo.edges.id) == [0, 1, 2]
+
+
+def test_split_multilinestrings():
+    """Should create one edge per part of a MultiLineString, duplicating attributes
+    """
+    ab = pygeos.linestrings([(0, 0), (0, 1)])
+    cd = pygeos.linestrings([(1, 1), (1, 2)])
+    ef = pygeos.linestrings([(2, 2), (2, 3)])
+    edges = pd.DataFrame(data={
+        'geometry': [pygeos.multilinestrings([ab, cd]), ef],
+        'highway': ['primary', 'trunk']
+    })
+    network = snkit.simplify.split_multilinestrings(snkit.simplify.Network(edges=edges))
+    assert list(network.edges.highway) == ['primary', 'primary', 'trunk']
+    assert list(pygeos.equals(network.edges.geometry.values, [ab, cd, ef])) == [True] * 3
+
+
+def test_split_multilinestrings_missing_geometry():
+    """Should keep edges without a geometry in place
+    """
+    ab = pygeos.linestrings([(0, 0), (0, 1)])
+    cd = pygeos.linestrings([(1, 1), (1, 2)])
+    edges = pd.DataFrame(data={
+        'geometry': [None, pygeos.multilinestrings([ab, cd]), None],
+        'highway': ['primary', 'trunk', 'secondary']
+    })
+    network = snkit.simplify.split_multilinestrings(snkit.simplify.Network(edges=edges))
+    assert list(network.edges.highway) == ['primary', 'trunk', 'trunk', 'secondary']
+    assert list(pygeos.is_missing(network.edges.geometry.values)) == [True, False, False, True]
+
+
+def test_add_endpoints():
+    """Should add nodes at edge endpoints, once per location
+    """
+    ab = pygeos.linestrings([(0, 0), (0, 1), (0, 2)])
+    bc = pygeos.linestrings([(0, 2), (1, 2)])
+    edges = pd.DataFrame(data={'geometry': [ab, bc]})
+    network = snkit.simplify.add_endpoints(snkit.simplify.Network(edges=edges))
+    expected = pygeos.points([(0, 0), (0, 2), (1, 2)])
+    assert list(pygeos.equals(network.nodes.geometry.values, expected)) == [True] * 3
+
+
+def test_drop_duplicate_geometries():
+    """Should drop repeated points and lines, keeping the first
+    """
+    nodes = pd.DataFrame(data={
+        'geometry': pygeos.points([(0, 0), (0, 1), (0, 0)]),
+        'id': [0, 1, 2]
+    })
+    assert list(snkit.simplify.drop_duplicate_geometries(nodes).id) == [0, 1]
+    assert list(snkit.simplify.drop_duplicate_geometries(nodes, keep='last').id) == [1, 2]
+    assert list(snkit.simplify.drop_duplicate_geometries(nodes, keep=False).id) == [1]
+
+    ab = pygeos.linestrings([(0, 0), (0, 1)])
+    edges = pd.DataFrame(data={
+        'geometry': [ab, pygeos.points(0, 0), ab],
+        'id': [0, 1, 2]
+    })
+    assert list(snkit.simplify.drop_duplicate_geometries(edges).id) == [0, 1]
+
+
+def test_merge_edges():
+    """Should merge edges through degree 2 nodes
+      a--b--c--d
+               |
+               e--f
+    """
+    coords = [(0, 0), (1, 0), (2, 0), (3, 0), (3, -1), (4, -1)]
+    nodes = pd.DataFrame(data={
+        'geometry': pygeos.points(coords),
+        'id': range(6)
+    })
+    pairs = [(0, 1), (1, 2), (2, 3), (3, 4), (4, 5)]
+    edges = pd.DataFrame(data={
+        'geometry': [pygeos.linestrings([coords[i], coords[j]]) for i, j in pairs],
+        'id': range(5),
+        'from_id': [i for i, _ in pairs],
+        'to_id': [j for _, j in pairs],
+    })
+    network = snkit.simplify.add_degree(snkit.simplify.Network(edges=edges, nodes=nodes))
+    merged = snkit.simplify.merge_edges(network)
+    assert len(merged.edges) == 1
+    assert sorted(merged.edges[['from_id', 'to_id']].iloc[0]) == [0, 5]
+    assert pygeos.equals(merged.edges.geometry.iat[0], pygeos.linestrings(coords))
+    assert list(merged.nodes.id) == [0, 5]
+
+
+def test_merge_edges_several_chains():
+    """Should merge every chain in one pass, including reversed edges
+      a--b--c--d--e--f
+               |
+               g
+    """
+    coords = [(0, 0), (1, 0), (2, 0), (3, 0), (4, 0), (5, 0), (3, -1)]
+    nodes = pd.DataFrame(data={
+        'geometry': pygeos.points(coords),
+        'id': range(7)
+    })
+    pairs = [(0, 1), (2, 1), (2, 3), (3, 4), (5, 4), (3, 6)]
+    edges = pd.DataFrame(data={
+        'geometry': [pygeos.linestrings([coords[i], coords[j]]) for i, j in pairs],
+        'id': range(6),
+        'from_id': [i for i, _ in pairs],
+        'to_id': [j for _, j in pairs],
+    })
+    network = snkit.simplify.add_degree(snkit.simplify.Network(edges=edges, nodes=nodes))
+    merged = snkit.simplify.merge_edges(network)
+    assert len(merged.edges) == 3
+    ends = sorted(tuple(sorted(e)) for e in merged.edges[['from_id', 'to_id']].to_numpy())
+    assert ends == [(0, 3), (3, 5), (3, 6)]
+    assert sorted(pygeos.length(merged.edges.geometry.to_numpy())) == [1, 2, 3]
+    assert list(merged.nodes.id) == [0, 3, 5, 6]
+
+
+def test_walk_deg2_chains_ring():
+    """Should keep one node of a ring of degree 2 nodes as both chain ends
+    """
+    from_ids = np.array([0, 1, 2])
+    to_ids = np.array([1, 2, 0])
+    indptr, neighbours, edge_of_neigh = snkit.simplify.build_csr(from_ids, to_ids, 3)
+    chain_edges, edge_ptr, chain_nodes, _, chain_ends = snkit.simplify.walk_deg2_chains(
+        indptr, neighbours, edge_of_neigh, np.array([2, 2, 2]))
+    assert sorted(chain_edges) == [0, 1, 2]
+    assert list(edge_ptr) == [0, 3]
+    assert sorted(chain_nodes) == [1, 2]
+    assert list(chain_ends[0]) == [0, 0]
+
+
+def test_clean_roundabouts():
+    """Should replace a roundabout by its centroid, extending the edges touching it
+          |
+         /d\\
+        a o c--
+         \\b/
+    """
+    ring = pygeos.linestrings([(-1, 0), (0, -1), (1, 0), (0, 1), (-1, 0)])
+    east = pygeos.linestrings([(1, 0), (3, 0)])
+    north = pygeos.linestrings([(0, 3), (0, 1)])
+    edges = pd.DataFrame(data={
+        'osm_id': [0, 1, 2],
+        'geometry': [ring, east, north],
+    })
+    cleaned = snkit.simplify.clean_roundabouts(snkit.simplify.Network(edges=edges))
+    assert list(cleaned.edges.osm_id) == [1, 2]
+    expected = [
+        pygeos.linestrings([(0, 0), (1, 0), (3, 0)]),
+        pygeos.linestrings([(0, 3), (0, 1), (0, 0)]),
+    ]
+    assert list(pygeos.equals_exact(cleaned.edges.geometry.values, expected)) == [True, True]
+
+
+def test_snap_nodes():
+    """Should snap nodes to the nearest edge, unless further than threshold
+      b |
+        |
+        | a
+    """
+    edges = pd.DataFrame(data={'geometry': [pygeos.linestrings([(0, 0), (0, 2)])]})
+    nodes = pd.DataFrame(data={'geometry': pygeos.points([(0.5, 0), (-0.5, 2)])})
+    network = snkit.simplify.Network(edges=edges, nodes=nodes)
+
+    snapped = snkit.simplify.snap_nodes(network)
+    expected = pygeos.points([(0, 0), (0, 2)])
+    assert list(pygeos.equals(snapped.nodes.geometry.values, expected)) == [True, True]
+
+    snapped = snkit.simplify.snap_nodes(network, threshold=0.1)
+    assert list(pygeos.equals(snapped.nodes.geometry.values, nodes.geometry.values)) == [True, True]
+
+
+def test_build_csr():
+    """Should list the neighbours and edges of each node, including parallel edges and self loops
+    """
+    from_ids = np.array([0, 1, 0, 2])
+    to_ids = np.array([1, 0, 2, 2])
+    indptr, neighbours, edge_of_neigh = snkit.simplify.build_csr(from_ids, to_ids, 4)
+    assert list(np.diff(indptr)) == [3, 2, 3, 0]
+    assert sorted(zip(neighbours[indptr[0]:indptr[1]], edge_of_neigh[indptr[0]:indptr[1]])) == [(1, 0), (1, 1), (2, 2)]
+    assert sorted(edge_of_neigh[indptr[2]:indptr[3]]) == [2, 3, 3]
+
+
+def test_drop_hanging_nodes(split_with_ids):
+    """Should drop short edges to degree 1 nodes, keeping longer ones
+      b
+     1| 2
+      c-d
+     0|
+      a
+    """
+    nodes = split_with_ids.nodes.copy()
+    nodes.loc[3, 'geometry'] = pygeos.points(0.001, 1)
+    edges = split_with_ids.edges.copy()
+    edges.loc[2, 'geometry'] = pygeos.linestrings([(0, 1), (0.001, 1)])
+    network = snkit.simplify.Network(edges=edges, nodes=nodes)
+    network = snkit.simplify.add_degree(snkit.simplify.add_topology(network))
+    dropped = snkit.simplify.drop_hanging_nodes(network, tolerance=0.005)
+    assert list(dropped.edges.id) == [0, 1]
+    assert list(dropped.nodes.degree) == [1, 1, 2, 0]
+
+
+def test_drop_hanging_nodes_id_out_of_index(split_with_ids):
+    """Should raise for edges referencing node ids past the nodes, with or
+    without a degree column
+    """
+    network = snkit.simplify.add_topology(split_with_ids)
+    network.edges.loc[2, 'to_id'] = 50000
+    with raises(IndexError):
+        snkit.simplify.drop_hanging_nodes(network)
+    network.nodes['degree'] = [1, 1, 3, 1]
+    with raises(IndexError):
+        snkit.simplify.drop_hanging_nodes(network)
+
+
+def test_sindex(split_with_ids):
+    """Should index the current geometries, also after editing them in place
+    """
+    network = split_with_ids
+    assert list(network.node_sindex.query(pygeos.points(50, 50))) == []
+    network.nodes.loc[1, 'geometry'] = pygeos.points(50, 50)
+    assert list(network.node_sindex.query(pygeos.points(50, 50))) == [1]
+    network.nodes.loc[:, 'geometry'] = pygeos.points([(60, 60)] * 4)
+    assert list(network.node_sindex.query(pygeos.points(50, 50))) == []
+
+    network.sindex_leafsize = 4
+    assert sorted(network.edge_sindex.query(pygeos.points(0, 1))) == [0, 1, 2]
+
+
+def test_round_geometries():
+    """Should round node and edge coordinates
+    """
+    nodes = pd.DataFrame(data={
+        'geometry': pygeos.points([(0.1234, 1.9876)]),
+        'id': [0]
+    })
+    edges = pd.DataFrame(data={
+        'geometry': [pygeos.linestrings([(0.1234, 1.9876), (2.0004, 3.5556)])],
+        'id': [0]
+    })
+    network = snkit.simplify.round_geometries(
+        snkit.simplify.Network(edges=edges, nodes=nodes), precision=2)
+    assert pygeos.equals(network.nodes.geometry.iat[0], pygeos.points(0.12, 1.99))
+    assert pygeos.equals(
+        network.edges.geometry.iat[0], pygeos.linestrings([(0.12, 1.99), (2.0, 3.56)]))
+
+
+def test_link_nodes_to_edges_within(monkeypatch):
+    """Should add a node on the edge and a linking edge for nodes within distance,
+    with or without dwithin
+      c
+      :
+    a-+-b
+    """
+    nodes = pd.DataFrame(data={
+        'geometry': pygeos.points([(0, 0), (2, 0), (1, 1)]),
+        'id': [0, 1, 2]
+    })
+    edges = pd.DataFrame(data={
+        'osm_id': [0],
+        'geometry': [pygeos.linestrings([(0, 0), (2, 0)])],
+        'highway': ['primary'],
+        'index': [0]
+    })
+    network = snkit.simplify.Network(edges=edges, nodes=nodes)
+    link = pygeos.linestrings([(1, 1), (1, 0)])
+    for has_dwithin in [True, False]:
+        monkeypatch.setattr(snkit.simplify, 'HAS_DWITHIN', has_dwithin)
+        linked = snkit.simplify.link_nodes_to_edges_within(network, 1.5)
+        assert len(linked.nodes) == 4
+        assert pygeos.equals(linked.nodes.geometry.iat[3], pygeos.points(1, 0))
+        assert pygeos.equals(linked.edges.geometry.to_numpy(), link).any()
+
+        linked = snkit.simplify.link_nodes_to_edges_within(
+            network, 1.5, condition=lambda node, edge: node.id != 2)
+        assert len(linked.nodes) == 3
+
+        # out of reach
+        linked = snkit.simplify.link_nodes_to_edges_within(network, 0.5)
+        assert len(linked.nodes) == 3
+
+
+def test_add_travel_time():
+    """Should look up speed by highway type, at unclassified speed for unknown,
+    missing or lists of types
+    """
+    edges = pd.DataFrame(data={
+        'geometry': pygeos.linestrings([[(0, 0), (1, 0)], [(1, 0), (2, 0)], [(2, 0), (3, 0)], [(3, 0), (4, 0)]]),
+        'highway': ['primary', 'footway', None, ['primary', 'secondary']],
+        'distance': [100000.0, 40000.0, 10000.0, 20000.0]
+    })
+    network = snkit.simplify.add_travel_time(snkit.simplify.Network(edges=edges))
+    assert np.allclose(network.edges.time, [2.0, 2.0, 0.5, 1.0])
+
+
+def test_add_modal(split_with_ids):
+    """Should link a ferry route to the nearest ends of the edges near its start
+    and end, skipping routes that start and end near the same edge or far away
+      b
+      |
+      c---d
+      |  /
+      a~~
+    """
+    network = snkit.simplify.add_degree(snkit.simplify.add_topology(split_with_ids))
+    routes = pd.DataFrame(data={
+        'osm_id': [7, 8, 9],
+        'highway': ['ferry'] * 3,
+        'geometry': [
+            pygeos.linestrings([(0.05, 0.05), (0.5, 0.5), (0.95, 1.05)]),
+            pygeos.linestrings([(0.05, 0.2), (0.05, 0.8)]),
+            pygeos.linestrings([(5, 5), (6, 6)])
+        ]
+    })
+    modal = snkit.simplify.add_modal(network, routes, threshold=0.1)
+    assert len(modal.edges) == len(network.edges) + 1
+    ferry = modal.edges.iloc[-1]
+    assert (ferry.osm_id, ferry.highway, ferry.id, ferry.from_id, ferry.to_id) == (7, 'ferry', 3, 0, 3)
+    assert pygeos.equals_exact(
+        ferry.geometry, pygeos.linestrings([(0, 0), (0.05, 0.05), (0.5, 0.5), (0.95, 1.05), (1, 1)]))
+    assert list(modal.nodes.degree) == [2, 1, 3, 2]
+
+
+def test_calculate_degree(split_with_ids):
+    """Should count edge ends at each node
+    """
+    topo = snkit.simplify.add_topology(split_with_ids)
+    assert list(snkit.simplify.calculate_degree(topo)) == [1, 1, 3, 1]
+
+
+def test_hanging_cascade():
+    """Should drop short hanging edges, then edges left disconnected
+      a--b-c  d--e
+    """
+    deg = np.array([1, 2, 1, 1, 1])
+    from_ids = np.array([0, 1, 3])
+    to_ids = np.array([1, 2, 4])
+    lengths = np.array([1., 0.001, 5.])
+    drop, new_deg = snkit.simplify.hanging_cascade(deg, from_ids, to_ids, lengths, 0.005)
+    assert list(drop) == [True, True, True]
+    assert list(new_deg) == [0, 0, 0, 0, 0]
+    assert list(deg) == [1, 2, 1, 1, 1]
+
+
+def test_node_connectivity_degree(split_with_ids):
+    """Should count the edges at a node
+    """
+    topo = snkit.simplify.add_topology(split_with_ids)
+    assert snkit.simplify.node_connectivity_degree(2, topo) == 3
+
+
+def test_node_connectivity_degree_by_id():
+    """Should look nodes up by id, not by row position, and count from the
+    edges rather than a possibly stale degree column
+      a-b-c with ids 10, 20, 30
+    """
+    nodes = pd.DataFrame(data={
+        'geometry': pygeos.points([(0, 0), (1, 0), (2, 0)]),
+        'id': [10, 20, 30]
+    })
+    edges = pd.DataFrame(data={
+        'geometry': pygeos.linestrings([[(0, 0), (1, 0)], [(1, 0), (2, 0)]]),
+        'id': [0, 1],
+        'from_id': [10, 20],
+        'to_id': [20, 30]
+    })
+    network = snkit.simplify.Network(nodes=nodes, edges=edges)
+    assert snkit.simplify.node_connectivity_degree(20, network) == 2
+    network.nodes['degree'] = [0, 0, 0]
+    assert snkit.simplify.node_connectivity_degree(20, network) == 2
+    assert snkit.simplify.node_connectivity_degree(30, network) == 1
+
+
+def test_reset_ids(split_with_ids):
+    """Should renumber nodes from 0 and re-reference edge from and to ids
+    """
+    topo = snkit.simplify.add_topology(split_with_ids)
+    nodes = topo.nodes.iloc[[3, 2, 1, 0]].copy()
+    nodes['id'] = [30, 20, 10, 0]
+    edges = topo.edges.copy()
+    edges['from_id'] = edges['from_id'] * 10
+    edges['to_id'] = edges['to_id'] * 10
+    reset = snkit.simplify.reset_ids(snkit.simplify.Network(edges=edges, nodes=nodes))
+    assert list(reset.nodes.id) == [0, 1, 2, 3]
+    assert list(reset.edges.from_id) == [3, 1, 1]
+    assert list(reset.edges.to_id) == [1, 2, 0]
+
+
+def test_snap_line():
+    """Should insert vertices at points on the line, in order along the line
+    """
+    line = pygeos.linestrings([(0, 0), (2, 0), (2, 2)])
+    points = pygeos.multipoints([(1, 0), (2, 1), (2, 0), (5, 5)])
+    snapped = snkit.simplify.snap_line(line, points)
+    assert pygeos.equals_exact(
+        snapped, pygeos.linestrings([(0, 0), (1, 0), (2, 0), (2, 1), (2, 2)]))
+
+    same_segment = snkit.simplify.snap_line(line, pygeos.multipoints([(1.5, 0), (0.5, 0), (1.5, 0)]))
+    assert pygeos.equals_exact(
+        same_segment, pygeos.linestrings([(0, 0), (0.5, 0), (1.5, 0), (2, 0), (2, 2)]))
+
+    single = snkit.simplify.add_vertex(line, pygeos.points(2, 0.5))
+    assert pygeos.equals_exact(single, pygeos.linestrings([(0, 0), (2, 0), (2, 0.5), (2, 2)]))
+
+
+def test_snap_line_v_shape():
+    """Should insert a point into the segment it lies on, even when its nearest
+    vertex does not bound that segment
+    """
+    line = pygeos.linestrings([(7.111, 9.321), (1.149, 7.29), (9.274, 9.679)])
+    # on the second segment, but nearest to the first vertex
+    point = pygeos.line_interpolate_point(pygeos.linestrings([(1.149, 7.29), (9.274, 9.679)]), 0.76, normalized=True)
+    snapped = snkit.simplify.snap_line(line, point)
+    assert pygeos.equals_exact(snapped, pygeos.linestrings(
+        [(7.111, 9.321), (1.149, 7.29), tuple(pygeos.get_coordinates(point)[0]), (9.274, 9.679)]))
+    assert np.isclose(pygeos.length(snapped), pygeos.length(line))
+
+
+def test_add_vertex_v_shape():
+    """Should add a vertex into the segment the point lies on, even when the
+    nearest vertex belongs to another part of the line, and leave the line
+    unchanged for a point that already is a vertex
+    """
+    line = pygeos.linestrings([(0, 0), (10, 0), (10, 2), (4.9, 0.1)])
+    added = snkit.simplify.add_vertex(line, pygeos.points(5, 0))
+    assert pygeos.equals_exact(added, pygeos.linestrings([(0, 0), (5, 0), (10, 0), (10, 2), (4.9, 0.1)]))
+    assert snkit.simplify.add_vertex(line, pygeos.points(10, 0)) is line
+
+
+def test_split_edges_at_nodes():
+    """Should split only at vertices shared with other edges, keeping edge ends
+      a-b-c-d along one edge, with e touching at c, and b at the swapped
+      coordinates of c
+    """
+    abcd = pygeos.linestrings([(0, 0), (1, 2), (2, 1), (3, 3)])
+    ce = pygeos.linestrings([(2, 1), (2, -1)])
+    edges = pd.DataFrame(data={
+        'osm_id': [0, 1],
+        'geometry': [abcd, ce],
+        'highway': ['primary', 'primary'],
+        'index': [0, 1]
+    })
+    split = snkit.simplify.split_edges_at_nodes(snkit.simplify.Network(edges=edges))
+    expected = [
+        pygeos.linestrings([(0, 0), (1, 2), (2, 1)]),
+        pygeos.linestrings([(2, 1), (3, 3)]),
+        ce
+    ]
+    assert len(split.edges) == 3
+    assert pygeos.equals_exact(split.edges.geometry.to_numpy(), expected).all()
+    assert list(split.edges.osm_id) == [0, 0, 1]
+
+
+def test_split_edges_at_nodes_missing_geometry():
+    """Should drop edges without a geometry and split the others
+    """
+    ab = pygeos.linestrings([(0, 0), (1, 0), (2, 0)])
+    cb = pygeos.linestrings([(1, 1), (1, 0)])
+    edges = pd.DataFrame(data={
+        'osm_id': [0, 1, 2, 3],
+        'geometry': [ab, None, cb, pygeos.Geometry('LINESTRING EMPTY')],
+        'highway': ['primary'] * 4,
+        'index': [0, 1, 2, 3]
+    })
+    split = snkit.simplify.split_edges_at_nodes(snkit.simplify.Network(edges=edges))
+    assert list(split.edges.osm_id) == [0, 0, 2]
+
+
+def test_quick_fix(split_with_ids):
+    """Should drop multi-part edges and edges referencing missing nodes
+    """
+    topo = snkit.simplify.add_topology(split_with_ids)
+    edges = topo.edges.copy()
+    edges['geometry'] = [
+        edges.geometry.iat[0],
+        pygeos.multilinestrings([edges.geometry.iat[1], edges.geometry.iat[2]]),
+        edges.geometry.iat[2]
+    ]
+    edges['to_id'] = [2, 1, 9]
+    fixed = snkit.simplify.quickFix(snkit.simplify.Network(edges=edges, nodes=topo.nodes))
+    assert len(fixed.edges) == 1
+    assert list(fixed.edges.to_id) == [2]
+    assert list(fixed.edges.id) == [0]
+
+
+def test_split_edge_at_points():
+    """Should split an edge at points on it, repeating its attributes
+    """
+    edge = pd.DataFrame(data={
+        'osm_id': [3],
+        'geometry': [pygeos.linestrings([(0, 0), (2, 0)])],
+        'highway': ['primary']
+    }).iloc[0]
+    points = pygeos.multipoints([(1, 0), (1.5, 0), (5, 5)])
+    split = snkit.simplify.split_edge_at_points(edge, points)
+    expected = pygeos.linestrings([[(0, 0), (1, 0)], [(1, 0), (1.5, 0)], [(1.5, 0), (2, 0)]])
+    assert pygeos.equals_exact(split.geometry.to_numpy(), expected).all()
+    assert list(split.osm_id) == [3, 3, 3]
+    assert list(split.highway) == ['primary'] * 3
+
+
+def test_split_edge_at_points_list_attribute():
+    """Should repeat list valued attributes whole, once per segment
+    """
+    edge = pd.DataFrame(data={
+        'osm_id': [3],
+        'geometry': [pygeos.linestrings([(0, 0), (2, 0)])],
+        'highway': [['primary', 'secondary']]
+    }).iloc[0]
+    split = snkit.simplify.split_edge_at_points(edge, pygeos.points(1, 0))
+    assert list(split.highway) == [['primary', 'secondary']] * 2
+
+
+def test_split_line_empty():
+    """Should leave a missing or empty line as it is
+    """
+    point = pygeos.points(1, 0)
+    assert snkit.simplify.split_line(None, point) == [None]
+    empty = pygeos.Geometry('LINESTRING EMPTY')
+    assert snkit.simplify.split_line(empty, point) == [empty]
+
+
+def test_set_precision():
+    """Should round a single geometry or an array of geometries
+    """
+    point = snkit.simplify.set_precision(pygeos.points(0.1234, 5.6789), 1)
+    assert pygeos.equals_exact(point, pygeos.points(0.1, 5.7))
+    lines = snkit.simplify.set_precision(
+        pygeos.linestrings([[(0.06, 0), (1.04, 0)], [(0, 0.06), (0, 1.04)]]), 1)
+    expected = pygeos.linestrings([[(0.1, 0), (1, 0)], [(0, 0.1), (0, 1)]])
+    assert pygeos.equals_exact(lines, expected).all()
+
+
+def test_intersects_within_tolerance(split_with_ids, monkeypatch):
+    """Should find the edges within tolerance of a point, with or without dwithin
+    """
+    edges = split_with_ids.edges
+    point = pygeos.points(0.5, 1.05)
+    for has_dwithin in [True, False]:
+        monkeypatch.setattr(snkit.simplify, 'HAS_DWITHIN', has_dwithin)
+        near = snkit.simplify.intersects(point, edges, split_with_ids.edge_sindex, tolerance=0.1)
+        assert sorted(near.id) == [2]
+        near = snkit.simplify.intersects(point, edges, split_with_ids.edge_sindex, tolerance=1)
+        assert sorted(near.id) == [0, 1, 2]
+
+
+def test_edges_within(split_with_ids, monkeypatch):
+    """Should find edges within distance, with or without a spatial index given
+    """
+    point = pygeos.points(0.5, 1.05)
+    edges = split_with_ids.edges
+    for has_dwithin in [True, False]:
+        monkeypatch.setattr(snkit.simplify, 'HAS_DWITHIN', has_dwithin)
+        assert sorted(snkit.simplify.edges_within(point, edges, 0.1).id) == [2]
+        assert sorted(snkit.simplify.edges_within(point, edges, 0.01).id) == []
+    near = snkit.simplify.edges_within(point, edges, 1, split_with_ids.edge_sindex)
+    assert sorted(near.id) == [0, 1, 2]